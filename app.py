@@ -1,25 +1,223 @@
 import os
 import io
+import re
+import sys
+import copy
+import gc
+import json
+import argparse
+import time
+import uuid
+import shutil
+import sqlite3
+import struct
+import hashlib
+import itertools
+import posixpath
 import tempfile
+import cProfile
+import logging
+import resource
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict, defaultdict
+from contextlib import closing, contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from functools import partial
 
-from flask import Flask, render_template_string, request, send_file, redirect, url_for, flash
+from flask import Flask, render_template_string, request, send_file, redirect, url_for, flash, jsonify
 from werkzeug.utils import secure_filename
 
+import numpy as np
 import pandas as pd
+from pandas.io.parsers import TextParser
+from lxml import etree
+from openpyxl.utils import range_boundaries
+from openpyxl.utils.exceptions import CellCoordinatesException
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string, get_column_letter
+from openpyxl.utils.escape import unescape
 from pptx import Presentation
-from pptx.util import Pt
-from pptx.dml.color import RGBColor
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.opc.oxml import serialize_part_xml
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls, qn
 from pptx.enum.text import PP_ALIGN
+from pptx.shapes.shapetree import SlideShapes
+from pptx.table import _Cell
+from pptx.util import Emu
 
 # ---------------- Flask setup ----------------
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "dev-key")
+app.logger.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
 
 # PPT Template on file directory
 PPT_TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), "TT_report.pptx")
+SAMPLE_WORKSHEET_PATH = os.path.join(os.path.dirname(__file__), "TT_worksheet.xlsm")
+# Template registry: every <name>.pptx in TEMPLATES_DIR is selectable by
+# name; an optional <name>.json beside it overrides "placeholders", "grids"
+# and/or "slide_tables" (same shapes as the built-in tables below). The
+# bundled TT_report.pptx is always available as "default".
+TEMPLATES_DIR = os.environ.get("TT_TEMPLATES_DIR", os.path.join(os.path.dirname(__file__), "templates"))
+DEFAULT_TEMPLATE = "default"
+TEMPLATE_PLAN_CACHE_SIZE = int(os.environ.get("TEMPLATE_PLAN_CACHE_SIZE", "16"))  # compiled templates per process
+# Set TT_WARM_UP=0 to skip the warm-up in create_app()
+WARM_UP = os.environ.get("TT_WARM_UP", "1") != "0"
 ALLOWED_EXCEL_EXTS = {".xlsm", ".xlsx"}
 
+# Scratch space for caches shared by gunicorn workers on the same dyno
+CACHE_DIR = os.environ.get("TT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tt-report-cache"))
+
+# Each process's metrics, added up by /metrics across workers and pools
+METRICS_DIR = os.path.join(CACHE_DIR, "metrics")
+
+# cProfile dumps: "request" honours ?profile=1 on /generate, "all" profiles
+# every generation. Off by default.
+PROFILE_MODE = os.environ.get("TT_PROFILE", "")
+PROFILES_DIR = os.path.join(CACHE_DIR, "profiles")
+
+# Incremental reports (POST /generate with report_id): the last deck and the
+# per-sheet hashes it was built from, so a re-upload only rebuilds the slides
+# whose source sheets changed
+REPORTS_DIR = os.path.join(CACHE_DIR, "reports")
+REPORT_TTL_SECONDS = int(os.environ.get("REPORT_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Processes that fill one report's slides in parallel; 1 fills them in order
+# in the request's own process. Batch items always render sequentially.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "1"))
+
+# Background report jobs (POST /generate with mode=async)
+JOBS_DIR = os.path.join(CACHE_DIR, "jobs")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))            # render processes per web worker
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", "8"))     # queued + running before 429
+JOB_TIMEOUT_SECONDS = int(os.environ.get("JOB_TIMEOUT_SECONDS", "600"))
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", "3600"))  # how long results stay downloadable
+PPTX_MIMETYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+# Batch generation (`python app.py batch DIR`, or POST /batch with a ZIP,
+# which queues one background job that fans its decks out over its own pool)
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", str(os.cpu_count() or 1)))
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "200"))
+# Pool size inside each running batch job: with every job slot on a batch,
+# JOB_WORKERS x BATCH_JOB_WORKERS processes render at once
+BATCH_JOB_WORKERS = int(os.environ.get("BATCH_JOB_WORKERS", str(max(1, BATCH_WORKERS // JOB_WORKERS))))
+# A batch job's deadline: JOB_TIMEOUT_SECONDS plus this per round of decks
+BATCH_SECONDS_PER_FILE = int(os.environ.get("BATCH_SECONDS_PER_FILE", "60"))
+
+# Generated decks keyed by workbook hash + template hash + code version
+RESULTS_DIR = os.path.join(CACHE_DIR, "results")
+RESULT_CACHE_MEMORY_MB = float(os.environ.get("RESULT_CACHE_MEMORY_MB", "64"))
+RESULT_CACHE_DISK_MB = float(os.environ.get("RESULT_CACHE_DISK_MB", "512"))
+with open(__file__, "rb") as _fh:
+    CODE_VERSION = os.environ.get("SOURCE_VERSION") or hashlib.sha256(_fh.read()).hexdigest()[:16]
+
+# Placeholder spec: key -> (sheet, cell, format). Cells are Excel references,
+# formats are names in PLACEHOLDER_FORMATS.
+PLACEHOLDER_SPEC = {
+    "VL10": ("LeasingInfographic", "A2", "percent_int"),
+    "VOP08": ("LeasingInfographic", "D2", "thousands"),
+    "LD08": ("LeasingInfographic", "D5", "percent_int"),
+    "MT08": ("LeasingInfographic", "D8", "percent_int"),
+    "VF08": ("LeasingInfographic", "D13", "raw"),
+    "HH08": ("LeasingInfographic", "H2", "percent_int"),
+    "HHI08": ("LeasingInfographic", "H5", "currency"),
+    "HHIMSA08": ("LeasingInfographic", "I5", "currency"),
+    "CD08": ("LeasingInfographic", "H8", "percent_int"),
+    "VC08": ("LeasingInfographic", "H11", "percent_int"),
+    "DT08": ("LeasingInfographic", "H13", "raw"),
+    "ZIP1": ("LeasingInfographic", "A5", "raw"),
+    "ZIP2": ("LeasingInfographic", "A6", "raw"),
+    "ZIP3": ("LeasingInfographic", "A7", "raw"),
+    "ZIP4": ("LeasingInfographic", "A8", "raw"),
+    "ZIP5": ("LeasingInfographic", "A9", "raw"),
+    "ZIPANALYSIS15": ("ZipCodes", "O2", "raw"),
+    "DDANALYSIS12": ("DrawDemo", "S2", "raw"),
+    "CMPANALYSIS10": ("CompetitiveMarketPosition", "J2", "raw"),
+    "MILANALYSIS11": ("MileageDemo", "D2", "raw"),
+}
+
+# Blocks of placeholders laid out like the sheet. Key "M{col}{row}" names the
+# block column by letter (A = first column of the range) and the row by number
+# counting from first_row; every row has one format, applied to the whole row.
+PLACEHOLDER_GRIDS = (
+    {
+        "sheet": "MileageDemo",
+        "range": "C4:F28",
+        "key": "M{col}{row}",
+        "first_row": 121,
+        "row_formats": (
+            ("thousands",) * 2 + ("percent",) * 6 + ("decimal",) + ("percent",) * 5
+            + ("currency",) + ("percent",) * 10
+        ),
+    },
+)
+
+# Slide tables: the first table on `slide` is filled from worksheet tab
+# `sheet`. "header" writes the DataFrame's column names into table row 0,
+# "first_row_header" styles the first data row as a header as well; "rules"
+# name the columns (or, for *_rows, row labels) that get a number format.
+# Rows up to the tab's first blank row that don't fit "rows_per_slide"
+# (default: the template table's body rows) carry on in copies of the slide
+# inserted after it, with the header rows repeated.
+SLIDE_TABLES = (
+    {
+        "slide": 9,
+        "sheet": "CompetitiveMarketPosition",
+        "header": True,
+        "rules": {"percent_columns": [3, 5, 6], "currency_columns": [2], "thousands_columns": [1]},
+    },
+    {
+        "slide": 11,
+        "sheet": "DrawDemo",
+        "header": True,
+        "rules": {
+            "percent_rows": [
+                "18-24", "25-34", "35-44", "45-54", "55-64", "65+",
+                "Less than $50,000", "$50,000-$74,999", "$75,000-$99,999",
+                "$100,000-$149,999", "$150,000 or more", "CHILDREN IN HOUSEHOLD",
+                "Less than college", "Some college", "College degree", "Post-graduate degree",
+                "Caucasian/White", "African-American/Black", "Hispanic/Latino",
+                "Asian", "Other"
+            ],
+            "currency_rows": ["HOUSEHOLD INCOME", "Average HH Income"],
+        },
+    },
+    {
+        "slide": 14,
+        "sheet": "ZipCodes",
+        "rules": {"percent_columns": [4, 5, 8], "currency_columns": [9], "thousands_columns": [6, 7]},
+    },
+    {
+        "slide": 36,
+        "sheet": "DistanceTravelled",
+        "header": True,
+        "first_row_header": True,
+        "rules": {"percent_columns": [1, 2, 3, 4, 5], "decimal_columns": [6, 7]},
+    },
+    {
+        "slide": 37,
+        "sheet": "Frequency",
+        "header": True,
+        "first_row_header": True,
+        "rules": {"percent_columns": [1, 2, 3], "decimal_columns": [4]},
+    },
+    {
+        "slide": 38,
+        "sheet": "Duration",
+        "header": True,
+        "first_row_header": True,
+        "rules": {"percent_columns": [1, 2, 3, 4], "decimal_columns": [5]},
+    },
+)
+TABLE_SLIDES = tuple(entry["slide"] for entry in SLIDE_TABLES)
+
+# Tabs copied into slide tables are read whole; any other tab is only read
+# through the cells PLACEHOLDER_SPEC/PLACEHOLDER_GRIDS point at.
+TABLE_SHEETS = tuple(dict.fromkeys(entry["sheet"] for entry in SLIDE_TABLES))
+
 HTML = """
 <!doctype html>
 <html lang="en">
@@ -83,6 +281,10 @@ HTML = """
     .btn-primary:hover{ background:var(--accent-hover); }
     .btn-ghost{ background:transparent; border:1px solid var(--border); color:var(--text); }
     .hint{ margin-top:10px; color:var(--muted); font-size:12px; }
+    select{
+      border:1px solid var(--border); background:rgba(2,6,23,.5); color:var(--text);
+      padding:12px 14px; border-radius:12px; font:inherit; font-size:14px;
+    }
     .flash{
       background:rgba(245,158,11,.1); color:#fde68a;
       border:1px solid rgba(245,158,11,.35);
@@ -135,6 +337,7 @@ HTML = """
           {% for m in messages %}<div class="flash">{{ m }}</div>{% endfor %}
         {% endif %}
       {% endwith %}
+      <div id="problems"></div>
 
       <form id="genForm" action="{{ url_for('generate') }}" method="post" enctype="multipart/form-data" onreset="resetName();">
         <div class="file-wrap">
@@ -143,6 +346,12 @@ HTML = """
           <input id="fileInput" type="file" name="xlsm" accept=".xlsm,.xlsx" required>
         </div>
 
+        {% if templates|length > 1 %}
+        <select name="template" aria-label="Report template">
+          {% for name in templates %}<option value="{{ name }}">{{ name }}</option>{% endfor %}
+        </select>
+        {% endif %}
+
         <button id="genBtn" class="btn btn-primary" type="submit">Generate</button>
         <button id="clearBtn" class="btn btn-ghost" type="reset">Clear</button>
       </form>
@@ -163,10 +372,29 @@ HTML = """
     const genBtn  = document.getElementById('genBtn');
     const clearBtn= document.getElementById('clearBtn');
     const overlay = document.getElementById('overlay');
+    const problemsEl = document.getElementById('problems');
 
-    function resetName(){ nameEl.textContent = 'No file selected'; }
-    input.addEventListener('change', () => {
+    // What /validate (or a rejected submit) found wrong with the workbook
+    function showProblems(problems){
+      problemsEl.replaceChildren(...problems.map(problem => {
+        const div = document.createElement('div');
+        div.className = 'flash';
+        div.textContent = problem.message;
+        return div;
+      }));
+    }
+
+    function resetName(){ nameEl.textContent = 'No file selected'; showProblems([]); }
+    input.addEventListener('change', async () => {
       nameEl.textContent = input.files.length ? input.files[0].name : 'No file selected';
+      showProblems([]);
+      if (!input.files.length) return;
+      try{
+        const res = await fetch("{{ url_for('validate') }}", { method: 'POST', body: new FormData(form) });
+        if(res.status === 422) showProblems((await res.json()).problems);
+      }catch(err){
+        console.error(err);  // generation reports the same problems
+      }
     });
 
     function showLoading(){
@@ -184,6 +412,22 @@ HTML = """
       genBtn.removeAttribute('aria-busy');
     }
 
+    // Poll a background job until its deck is ready, then fetch it
+    async function waitForJob(job){
+      while(true){
+        await new Promise(resolve => setTimeout(resolve, 1500));
+        const res = await fetch(job.status_url);
+        if(!res.ok) throw new Error('Lost track of the report job.');
+        const state = await res.json();
+        if(state.status === 'done'){
+          const file = await fetch(state.result_url);
+          if(!file.ok) throw new Error('Could not download the report.');
+          return file.blob();
+        }
+        if(state.status === 'failed') throw new Error(`Error generating report: ${state.error}`);
+      }
+    }
+
     // Intercept submit so we can show spinner and control the download
     form.addEventListener('submit', async (e) => {
       e.preventDefault();
@@ -192,13 +436,24 @@ HTML = """
       try{
         showLoading();
         const fd = new FormData(form);
+        fd.append('mode', 'async');
         const res = await fetch(form.action, { method: 'POST', body: fd });
+        if(res.status === 422){
+          hideLoading();
+          showProblems((await res.json()).problems);
+          return;
+        }
+        if(res.status === 429){
+          hideLoading();
+          alert('The report queue is busy. Please try again in a minute.');
+          return;
+        }
         if(!res.ok){
           hideLoading();
           alert('Error generating report. Please check your file and try again.');
           return;
         }
-        const blob = await res.blob();
+        const blob = await waitForJob(await res.json());
         const url = URL.createObjectURL(blob);
         const a = document.createElement('a');
         const ts = new Date().toISOString().slice(0,16).replace('T','_');
@@ -210,7 +465,7 @@ HTML = """
         URL.revokeObjectURL(url);
       }catch(err){
         console.error(err);
-        alert('Unexpected error. Please try again.');
+        alert(err.message || 'Unexpected error. Please try again.');
       }finally{
         hideLoading();
       }
@@ -220,229 +475,1955 @@ HTML = """
 </html>
 
 """
+# Metrics
+# Counters, gauges and histograms are kept per process and written to
+# METRICS_DIR/<pid>.json at the end of every request and generation (and when a
+# template compiles); /metrics adds up the files' counters and histograms, so
+# a scrape covers every gunicorn worker and pool process on the dyno. Gauges
+# describe one live process (a forked worker shares the master's plans, so
+# summing would overstate them) and are exported per process with a "pid"
+# label; a dead process's counters still count, its gauges are dropped.
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_metrics = defaultdict(float)
+_histograms = {}
+_metric_types = {}
+_metrics_lock = threading.Lock()
+
+def _reset_metrics():
+    # A forked child (gunicorn worker, pool process) starts its own counts,
+    # since the parent's are already in the parent's file; its gauges carry
+    # over because the child inherits what they describe, and go out under
+    # the child's own pid
+    global _metrics_lock
+    _metrics_lock = threading.Lock()
+    for key in [key for key in _metrics if _metric_types.get(key[0]) != "gauge"]:
+        del _metrics[key]
+    _histograms.clear()
+
+os.register_at_fork(after_in_child=_reset_metrics)
+
+def inc_metric(name: str, amount: float = 1, **labels):
+    with _metrics_lock:
+        _metric_types[name] = "counter"
+        _metrics[(name, tuple(sorted(labels.items())))] += amount
+
+def set_metric(name: str, value: float, **labels):
+    with _metrics_lock:
+        _metric_types[name] = "gauge"
+        _metrics[(name, tuple(sorted(labels.items())))] = value
+
+def observe_metric(name: str, value: float, buckets=STAGE_BUCKETS, **labels):
+    with _metrics_lock:
+        _metric_types[name] = "histogram"
+        key = (name, tuple(sorted(labels.items())))
+        counts, total, count = _histograms.get(key, ([0] * len(buckets), 0.0, 0))
+        counts = [n + (value <= bound) for n, bound in zip(counts, buckets)]
+        _histograms[key] = (counts, total + value, count + 1)
+
+def flush_metrics():
+    with _metrics_lock:
+        snapshot = {
+            "types": dict(_metric_types),
+            "samples": [[name, labels, value] for (name, labels), value in _metrics.items()],
+            "histograms": [[name, labels, *histogram] for (name, labels), histogram in _histograms.items()],
+        }
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(f"{path}.tmp", "w") as fh:
+            json.dump(snapshot, fh)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        app.logger.warning("Could not write metrics to %s: %s", path, e)
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _collect_metrics():
+    # Every process's last flush: counters and histograms added up, gauges
+    # of live processes labelled with their pid
+    samples, histograms, types = defaultdict(float), {}, {}
+    entries = os.scandir(METRICS_DIR) if os.path.isdir(METRICS_DIR) else []
+    for entry in entries:
+        name, ext = os.path.splitext(entry.name)
+        if ext != ".json" or not name.isdigit():
+            continue
+        try:
+            with open(entry.path) as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        alive = _process_alive(int(name))
+        types.update(data["types"])
+        for metric, labels, value in data["samples"]:
+            labels = tuple(map(tuple, labels))
+            if data["types"][metric] != "gauge":
+                samples[(metric, labels)] += value
+            elif alive:
+                samples[(metric, labels + (("pid", name),))] = value
+        for metric, labels, counts, total, count in data["histograms"]:
+            key = (metric, tuple(map(tuple, labels)))
+            old_counts, old_total, old_count = histograms.get(key, ([0] * len(counts), 0.0, 0))
+            histograms[key] = ([a + b for a, b in zip(old_counts, counts)], old_total + total, old_count + count)
+    return samples, histograms, types
+
+def _metric_line(name: str, labels, value) -> str:
+    label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+    return f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}"
+
+def render_metrics(gauges: dict = None) -> str:
+    # Every process's metrics plus `gauges` ({(name, labels): value}), values
+    # the caller read from state all processes share
+    flush_metrics()
+    samples, histograms, types = _collect_metrics()
+    for key, value in (gauges or {}).items():
+        samples[key] = value
+        types[key[0]] = "gauge"
+    lines, typed = [], set()
+    for (name, labels), value in sorted(samples.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} {types[name]}")
+            typed.add(name)
+        lines.append(_metric_line(name, labels, value))
+    for (name, labels), (counts, total, count) in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        for bound, count in zip(STAGE_BUCKETS, counts):
+            lines.append(_metric_line(f"{name}_bucket", labels + (("le", f"{bound:g}"),), count))
+        lines.append(_metric_line(f"{name}_bucket", labels + (("le", "+Inf"),), count))
+        lines.append(_metric_line(f"{name}_sum", labels, total))
+        lines.append(_metric_line(f"{name}_count", labels, count))
+    return "\n".join(lines) + "\n"
+
+def _proc_status_mb(field: str) -> float:
+    # VmRSS (current) or VmHWM (peak since the last reset) from /proc/self/status
+    with open("/proc/self/status") as fh:
+        for line in fh:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1]) / 1024
+    raise OSError(f"no {field} in /proc/self/status")
+
+def _reset_peak_rss() -> bool:
+    # Writing 5 to clear_refs restarts the kernel's peak RSS (VmHWM) from the
+    # current RSS (Linux 4.0+), so the next reading covers only what follows
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+        return True
+    except OSError:
+        return False
+
+def _rss_mb() -> float:
+    try:
+        return _proc_status_mb("VmRSS")
+    except OSError:
+        # No /proc: ru_maxrss (KiB on Linux) is the best there is
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class StageTimer:
+    # Wall time plus peak RSS (and its growth) for each named stage of one
+    # run. The peak is the process's: a request or job renders one at a time.
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start, rss_before = time.perf_counter(), _rss_mb()
+        peak_reset = _reset_peak_rss()
+        try:
+            yield
+        finally:
+            rss_after = _rss_mb()
+            # Without a resettable peak, the larger of the two samples
+            peak = _proc_status_mb("VmHWM") if peak_reset else max(rss_before, rss_after)
+            self.stages[name] = {
+                "seconds": round(time.perf_counter() - start, 4),
+                "peak_rss_mb": round(peak, 1),
+                "rss_growth_mb": round(peak - rss_before, 1),
+            }
+
 # Logic 
-def build_presentation(xlsm_path: str, template_path: str) -> io.BytesIO:
-    # Load template PPT
-    prs = Presentation(template_path)
+def compile_placeholders(keys) -> re.Pattern:
+    # One alternation for every placeholder key. Longest keys go first so that
+    # e.g. "MA121" wins over a shorter key sharing its prefix.
+    ordered = sorted(keys, key=len, reverse=True)
+    if not ordered:
+        return re.compile(r"(?!)")  # matches nothing
+    return re.compile("|".join(re.escape(key) for key in ordered))
 
-    # Read Excel sheets (openpyxl reads .xlsm/.xlsx; macros aren’t executed)
-    dfs = pd.read_excel(
-        xlsm_path,
-        sheet_name=[
-            "LeasingInfographic", "CompetitiveMarketPosition", "ZipCodes",
-            "DrawDemo", "DistanceTravelled", "Frequency", "Duration", "MileageDemo"
-        ],
-        engine="openpyxl",
+class SpecError(ValueError):
+    """The worksheet doesn't match PLACEHOLDER_SPEC/PLACEHOLDER_GRIDS, or a template's .json spec is malformed."""
+
+    def __init__(self, problems, summary="Worksheet doesn't match the report layout"):
+        self.problems = problems
+        self.summary = summary
+        super().__init__(f"{summary}: " + "; ".join(p["message"] for p in problems))
+
+def spec_problem(code: str, message: str, **where) -> dict:
+    # One worksheet problem as reported in SpecError.problems and by /validate:
+    # a stable code, a readable message, and the key/sheet/cell it concerns
+    return {"code": code, **where, "message": message}
+
+PLACEHOLDER_FORMATS = {
+    "raw": str,
+    "percent_int": lambda v: f"{int(round(v * 100, 0))}%",
+    "percent": lambda v: f"{v * 100:.1f}%",
+    "decimal": lambda v: f"{v:.1f}",
+    "thousands": "{:,.0f}".format,
+    "currency": "${:,.0f}".format,
+}
+
+def _format_block(values: np.ndarray, fmt: str) -> np.ndarray:
+    # Same strings as PLACEHOLDER_FORMATS, a whole block of floats at a time
+    if fmt == "percent":
+        return np.char.add(np.char.mod("%.1f", values * 100), "%")
+    if fmt == "decimal":
+        return np.char.mod("%.1f", values)
+    return np.array([PLACEHOLDER_FORMATS[fmt](v) for v in values.ravel()]).reshape(values.shape)
+
+def _expand_grid(grid: dict):
+    # Yields (key, row, col, format) for every placeholder in a grid block
+    min_col, min_row, max_col, max_row = range_boundaries(grid["range"])
+    for i, row in enumerate(range(min_row, max_row + 1)):
+        for j, col in enumerate(range(min_col, max_col + 1)):
+            key = grid["key"].format(col=get_column_letter(j + 1), row=grid["first_row"] + i)
+            yield key, row, col, grid["row_formats"][i]
+
+def spec_cells(spec: dict = None, grids=None):
+    # Every (key, sheet, row, col, format) the spec reads
+    spec = PLACEHOLDER_SPEC if spec is None else spec
+    grids = PLACEHOLDER_GRIDS if grids is None else grids
+    for key, (sheet, ref, fmt) in spec.items():
+        col_letter, row = coordinate_from_string(ref)
+        yield key, sheet, row, column_index_from_string(col_letter), fmt
+    for grid in grids:
+        for key, row, col, fmt in _expand_grid(grid):
+            yield key, grid["sheet"], row, col, fmt
+
+def spec_ranges(spec: dict = None, grids=None, table_sheets=None) -> dict:
+    # Bounding range per non-table sheet, i.e. what load_worksheet must fetch
+    table_sheets = TABLE_SHEETS if table_sheets is None else table_sheets
+    bounds = {}
+    for _, sheet, row, col, _ in spec_cells(spec, grids):
+        if sheet in table_sheets:
+            continue
+        lo_r, lo_c, hi_r, hi_c = bounds.get(sheet, (row, col, row, col))
+        bounds[sheet] = (min(lo_r, row), min(lo_c, col), max(hi_r, row), max(hi_c, col))
+    return {
+        sheet: f"{get_column_letter(lo_c)}{lo_r}:{get_column_letter(hi_c)}{hi_r}"
+        for sheet, (lo_r, lo_c, hi_r, hi_c) in bounds.items()
+    }
+
+def _sheet_value(tables: dict, cells: dict, sheet: str, row: int, col: int):
+    # Raises KeyError for a sheet the workbook doesn't have, IndexError for a
+    # cell outside the data pandas read (row 1 is the DataFrame header).
+    if sheet in tables:
+        df = tables[sheet]
+        if not (2 <= row <= len(df) + 1 and 1 <= col <= df.shape[1]):
+            raise IndexError(row, col)
+        return df.iloc[row - 2, col - 1]
+    return cells[sheet].get((row, col), float("nan"))
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, bool)
+
+def check_spec(tables: dict, cells: dict, spec: dict = None, grids=None) -> list:
+    # Problems that would otherwise surface as IndexError/ValueError mid-render
+    problems = []
+    for key, sheet, row, col, fmt in spec_cells(spec, grids):
+        cell = f"{get_column_letter(col)}{row}"
+        ref = f"{sheet}!{cell}"
+        where = {"key": key, "sheet": sheet, "cell": cell}
+        try:
+            value = _sheet_value(tables, cells, sheet, row, col)
+        except KeyError:
+            problems.append(spec_problem("missing_sheet", f"{key}: sheet {sheet} is missing", key=key, sheet=sheet))
+            continue
+        except IndexError:
+            problems.append(spec_problem("out_of_range", f"{key}: {ref} is outside the data on {sheet}", **where))
+            continue
+        if fmt == "raw":
+            continue
+        # A blank cell reads as NaN, which every numeric format would print as "nan"
+        if not _is_number(value):
+            problems.append(spec_problem("not_a_number", f"{key}: {ref} is {value!r}, expected a number", **where))
+        elif pd.isna(value):
+            problems.append(spec_problem("blank", f"{key}: {ref} is blank, expected a number", **where))
+    return problems
+
+def build_variable_mapping(tables: dict, cells: dict, keys=None, spec: dict = None, grids=None) -> dict:
+    # Formatted text for every placeholder; with `keys`, only those present
+    # in the template are looked up and formatted.
+    spec = PLACEHOLDER_SPEC if spec is None else spec
+    grids = PLACEHOLDER_GRIDS if grids is None else grids
+    problems = check_spec(tables, cells, spec, grids)
+    if problems:
+        raise SpecError(problems)
+
+    mapping = {}
+    for key, (sheet, ref, fmt) in spec.items():
+        if keys is not None and key not in keys:
+            continue
+        col_letter, row = coordinate_from_string(ref)
+        value = _sheet_value(tables, cells, sheet, row, column_index_from_string(col_letter))
+        mapping[key] = PLACEHOLDER_FORMATS[fmt](value)
+
+    for grid in grids:
+        placeholders = list(_expand_grid(grid))
+        if keys is not None and not any(key in keys for key, *_ in placeholders):
+            continue
+        min_col, min_row, max_col, max_row = range_boundaries(grid["range"])
+        values = np.array([
+            [_sheet_value(tables, cells, grid["sheet"], row, col) for col in range(min_col, max_col + 1)]
+            for row in range(min_row, max_row + 1)
+        ], dtype=float)
+        formats = np.array(grid["row_formats"])
+        text = np.empty(values.shape, dtype=object)
+        for fmt in np.unique(formats):
+            rows = formats == fmt
+            text[rows] = _format_block(values[rows], fmt)
+        for key, row, col, _ in placeholders:
+            mapping[key] = str(text[row - min_row, col - min_col])
+    return mapping
+
+PLACEHOLDER_KEYS = tuple(key for key, *_ in spec_cells())
+
+TABLE_FORMATS = {
+    "percent": lambda v: f"{round(v * 100, 1)}%",
+    "currency": "${:,.0f}".format,
+    "thousands": "{:,.0f}".format,
+    "decimal": lambda v: f"{v:.1f}",
+}
+
+_to_text = np.frompyfunc(str, 1, 1)
+_is_number_array = np.frompyfunc(_is_number, 1, 1)
+
+def format_table(df: pd.DataFrame, rules: dict, rows: int, cols: int) -> np.ndarray:
+    # The top-left rows x cols of `df` as display strings, in one pass: a
+    # format name is resolved per column (or per row label, for *_rows rules)
+    # and each format is applied to all its numeric cells at once.
+    values = df.iloc[:rows, :cols].to_numpy(dtype=object)
+    blank = pd.isna(values)
+    numeric = _is_number_array(values).astype(bool) & ~blank
+    formats = np.full(values.shape, None, dtype=object)
+
+    if "percent_rows" in rules or "currency_rows" in rules:
+        for row_index, label in enumerate(str(v) for v in df.iloc[:rows, 0]):
+            if any(keyword in label for keyword in rules.get("percent_rows", [])):
+                formats[row_index, :] = "percent"
+            elif any(keyword in label for keyword in rules.get("currency_rows", [])):
+                formats[row_index, :] = "currency"
+    else:
+        # Lowest priority first so earlier rules win where columns overlap
+        for name in ("decimal", "thousands", "currency", "percent"):
+            columns = [c for c in rules.get(f"{name}_columns", []) if c < values.shape[1]]
+            formats[:, columns] = name
+
+    text = _to_text(values) if values.size else values
+    for col_index in range(values.shape[1]):
+        # Native column values, so float columns format (and round) as np.float64
+        column = df.iloc[:rows, col_index].to_numpy()
+        for name, formatter in TABLE_FORMATS.items():
+            mask = numeric[:, col_index] & (formats[:, col_index] == name)
+            if mask.any():
+                text[mask, col_index] = [formatter(v) for v in column[mask]]
+    text[blank] = ""
+    return text
+
+# Run styles
+# One pre-built <a:rPr> per look. Cloning it onto a run is a single tree
+# insert, where setting font name/size/color/bold is four separate mutations.
+def _run_style(color: str, bold: bool = False):
+    bold_attr = ' b="1"' if bold else ""
+    return parse_xml(
+        f'<a:rPr {nsdecls("a")} sz="900"{bold_attr}><a:solidFill><a:srgbClr val="{color}"/></a:solidFill>'
+        '<a:latin typeface="Roboto"/></a:rPr>'
     )
-    df_leasing = dfs["LeasingInfographic"]
-    df_sheet2 = dfs["CompetitiveMarketPosition"]
-    df_zipcodes = dfs["ZipCodes"]
-    df_drawdemos = dfs["DrawDemo"]
-    df_distance = dfs["DistanceTravelled"]
-    df_frequency = dfs["Frequency"]
-    df_duration = dfs["Duration"]
-    df_mileage = dfs["MileageDemo"]
-
-    variable_mapping = {
-        "VL10": f"{int(round(df_leasing.iloc[0, 0] * 100, 0))}%",
-        "VOP08": "{:,.0f}".format(df_leasing.iloc[0, 3]),
-        "LD08": f"{int(round(df_leasing.iloc[3, 3] * 100, 0))}%",
-        "MT08": f"{int(round(df_leasing.iloc[6, 3] * 100, 0))}%",
-        "VF08": df_leasing.iloc[11, 3],
-        "HH08": f"{int(round(df_leasing.iloc[0, 7] * 100, 0))}%",
-        "HHI08": "${:,.0f}".format(df_leasing.iloc[3, 7]),
-        "HHIMSA08": "${:,.0f}".format(df_leasing.iloc[3, 8]),
-        "CD08": f"{int(round(df_leasing.iloc[6, 7] * 100, 0))}%",
-        "VC08": f"{int(round(df_leasing.iloc[9, 7] * 100, 0))}%",
-        "DT08": df_leasing.iloc[11, 7],
-        "ZIP1": df_leasing.iloc[3, 0],
-        "ZIP2": df_leasing.iloc[4, 0],
-        "ZIP3": df_leasing.iloc[5, 0],
-        "ZIP4": df_leasing.iloc[6, 0],
-        "ZIP5": df_leasing.iloc[7, 0],
-        "ZIPANALYSIS15": df_zipcodes.iloc[0, 14],
-        "DDANALYSIS12": df_drawdemos.iloc[0, 18],
-        "CMPANALYSIS10": df_sheet2.iloc[0, 9],
-        "MILANALYSIS11": df_mileage.iloc[0, 3],
-
-        # Mileage Demos mapping
-        "MA121": f"{df_mileage.iloc[2, 2]:,.0f}", "MB121": f"{df_mileage.iloc[2, 3]:,.0f}", "MC121": f"{df_mileage.iloc[2, 4]:,.0f}", "MD121": f"{df_mileage.iloc[2, 5]:,.0f}",
-        "MA122": f"{df_mileage.iloc[3, 2]:,.0f}", "MB122": f"{df_mileage.iloc[3, 3]:,.0f}", "MC122": f"{df_mileage.iloc[3, 4]:,.0f}", "MD122": f"{df_mileage.iloc[3, 5]:,.0f}",
-        "MA123": f"{df_mileage.iloc[4, 2] * 100:.1f}%",  "MB123": f"{df_mileage.iloc[4, 3] * 100:.1f}%",  "MC123": f"{df_mileage.iloc[4, 4] * 100:.1f}%",  "MD123": f"{df_mileage.iloc[4, 5] * 100:.1f}%",
-        "MA124": f"{df_mileage.iloc[5, 2] * 100:.1f}%",  "MB124": f"{df_mileage.iloc[5, 3] * 100:.1f}%",  "MC124": f"{df_mileage.iloc[5, 4] * 100:.1f}%",  "MD124": f"{df_mileage.iloc[5, 5] * 100:.1f}%",
-        "MA125": f"{df_mileage.iloc[6, 2] * 100:.1f}%",  "MB125": f"{df_mileage.iloc[6, 3] * 100:.1f}%",  "MC125": f"{df_mileage.iloc[6, 4] * 100:.1f}%",  "MD125": f"{df_mileage.iloc[6, 5] * 100:.1f}%",
-        "MA126": f"{df_mileage.iloc[7, 2] * 100:.1f}%",  "MB126": f"{df_mileage.iloc[7, 3] * 100:.1f}%",  "MC126": f"{df_mileage.iloc[7, 4] * 100:.1f}%",  "MD126": f"{df_mileage.iloc[7, 5] * 100:.1f}%",
-        "MA127": f"{df_mileage.iloc[8, 2] * 100:.1f}%",  "MB127": f"{df_mileage.iloc[8, 3] * 100:.1f}%",  "MC127": f"{df_mileage.iloc[8, 4] * 100:.1f}%",  "MD127": f"{df_mileage.iloc[8, 5] * 100:.1f}%",
-        "MA128": f"{df_mileage.iloc[9, 2] * 100:.1f}%",  "MB128": f"{df_mileage.iloc[9, 3] * 100:.1f}%",  "MC128": f"{df_mileage.iloc[9, 4] * 100:.1f}%",  "MD128": f"{df_mileage.iloc[9, 5] * 100:.1f}%",
-        "MA129": f"{df_mileage.iloc[10, 2]:.1f}", "MB129": f"{df_mileage.iloc[10, 3]:.1f}", "MC129": f"{df_mileage.iloc[10, 4]:.1f}", "MD129": f"{df_mileage.iloc[10, 5]:.1f}",
-        "MA130": f"{df_mileage.iloc[11, 2] * 100:.1f}%", "MB130": f"{df_mileage.iloc[11, 3] * 100:.1f}%", "MC130": f"{df_mileage.iloc[11, 4] * 100:.1f}%", "MD130": f"{df_mileage.iloc[11, 5] * 100:.1f}%",
-        "MA131": f"{df_mileage.iloc[12, 2] * 100:.1f}%", "MB131": f"{df_mileage.iloc[12, 3] * 100:.1f}%", "MC131": f"{df_mileage.iloc[12, 4] * 100:.1f}%", "MD131": f"{df_mileage.iloc[12, 5] * 100:.1f}%",
-        "MA132": f"{df_mileage.iloc[13, 2] * 100:.1f}%", "MB132": f"{df_mileage.iloc[13, 3] * 100:.1f}%", "MC132": f"{df_mileage.iloc[13, 4] * 100:.1f}%", "MD132": f"{df_mileage.iloc[13, 5] * 100:.1f}%",
-        "MA133": f"{df_mileage.iloc[14, 2] * 100:.1f}%", "MB133": f"{df_mileage.iloc[14, 3] * 100:.1f}%", "MC133": f"{df_mileage.iloc[14, 4] * 100:.1f}%", "MD133": f"{df_mileage.iloc[14, 5] * 100:.1f}%",
-        "MA134": f"{df_mileage.iloc[15, 2] * 100:.1f}%", "MB134": f"{df_mileage.iloc[15, 3] * 100:.1f}%", "MC134": f"{df_mileage.iloc[15, 4] * 100:.1f}%", "MD134": f"{df_mileage.iloc[15, 5] * 100:.1f}%",
-        "MA135": "${:,.0f}".format(df_mileage.iloc[16, 2]), "MB135": "${:,.0f}".format(df_mileage.iloc[16, 3]), "MC135": "${:,.0f}".format(df_mileage.iloc[16, 4]), "MD135": "${:,.0f}".format(df_mileage.iloc[16, 5]),
-        "MA136": f"{df_mileage.iloc[17, 2] * 100:.1f}%", "MB136": f"{df_mileage.iloc[17, 3] * 100:.1f}%", "MC136": f"{df_mileage.iloc[17, 4] * 100:.1f}%", "MD136": f"{df_mileage.iloc[17, 5] * 100:.1f}%",
-        "MA137": f"{df_mileage.iloc[18, 2] * 100:.1f}%", "MB137": f"{df_mileage.iloc[18, 3] * 100:.1f}%", "MC137": f"{df_mileage.iloc[18, 4] * 100:.1f}%", "MD137": f"{df_mileage.iloc[18, 5] * 100:.1f}%",
-        "MA138": f"{df_mileage.iloc[19, 2] * 100:.1f}%", "MB138": f"{df_mileage.iloc[19, 3] * 100:.1f}%", "MC138": f"{df_mileage.iloc[19, 4] * 100:.1f}%", "MD138": f"{df_mileage.iloc[19, 5] * 100:.1f}%",
-        "MA139": f"{df_mileage.iloc[20, 2] * 100:.1f}%", "MB139": f"{df_mileage.iloc[20, 3] * 100:.1f}%", "MC139": f"{df_mileage.iloc[20, 4] * 100:.1f}%", "MD139": f"{df_mileage.iloc[20, 5] * 100:.1f}%",
-        "MA140": f"{df_mileage.iloc[21, 2] * 100:.1f}%", "MB140": f"{df_mileage.iloc[21, 3] * 100:.1f}%", "MC140": f"{df_mileage.iloc[21, 4] * 100:.1f}%", "MD140": f"{df_mileage.iloc[21, 5] * 100:.1f}%",
-        "MA141": f"{df_mileage.iloc[22, 2] * 100:.1f}%", "MB141": f"{df_mileage.iloc[22, 3] * 100:.1f}%", "MC141": f"{df_mileage.iloc[22, 4] * 100:.1f}%", "MD141": f"{df_mileage.iloc[22, 5] * 100:.1f}%",
-        "MA142": f"{df_mileage.iloc[23, 2] * 100:.1f}%", "MB142": f"{df_mileage.iloc[23, 3] * 100:.1f}%", "MC142": f"{df_mileage.iloc[23, 4] * 100:.1f}%", "MD142": f"{df_mileage.iloc[23, 5] * 100:.1f}%",
-        "MA143": f"{df_mileage.iloc[24, 2] * 100:.1f}%", "MB143": f"{df_mileage.iloc[24, 3] * 100:.1f}%", "MC143": f"{df_mileage.iloc[24, 4] * 100:.1f}%", "MD143": f"{df_mileage.iloc[24, 5] * 100:.1f}%",
-        "MA144": f"{df_mileage.iloc[25, 2] * 100:.1f}%", "MB144": f"{df_mileage.iloc[25, 3] * 100:.1f}%", "MC144": f"{df_mileage.iloc[25, 4] * 100:.1f}%", "MD144": f"{df_mileage.iloc[25, 5] * 100:.1f}%",
-        "MA145": f"{df_mileage.iloc[26, 2] * 100:.1f}%", "MB145": f"{df_mileage.iloc[26, 3] * 100:.1f}%", "MC145": f"{df_mileage.iloc[26, 4] * 100:.1f}%", "MD145": f"{df_mileage.iloc[26, 5] * 100:.1f}%"
+
+RUN_STYLES = {
+    "body": _run_style("000000"),               # Roboto 9pt black
+    "header": _run_style("FFFFFF", bold=True),  # Roboto 9pt white bold
+}
+
+def set_cell_text(cell, text: str, style: str, alignment=None):
+    # cell.text leaves fresh runs without an rPr, so the clone is the only one
+    cell.text = text
+    rpr = RUN_STYLES[style]
+    for p in cell._tc.txBody.iterchildren(qn("a:p")):
+        if alignment is not None:
+            p.get_or_add_pPr().algn = alignment
+        for r in p.iterchildren(qn("a:r")):
+            r.insert(0, copy.deepcopy(rpr))
+
+# Template registry
+def list_templates() -> dict:
+    # name -> .pptx path; "default" first, then TEMPLATES_DIR alphabetically
+    templates = {DEFAULT_TEMPLATE: PPT_TEMPLATE_PATH}
+    if os.path.isdir(TEMPLATES_DIR):
+        for filename in sorted(os.listdir(TEMPLATES_DIR)):
+            name, ext = os.path.splitext(filename)
+            if ext.lower() == ".pptx" and not filename.startswith(("~$", ".")):
+                templates.setdefault(name, os.path.join(TEMPLATES_DIR, filename))
+    return templates
+
+def _spec_path(template_path: str) -> str:
+    return os.path.splitext(template_path)[0] + ".json"
+
+TABLE_RULES = {f"{name}_columns" for name in TABLE_FORMATS} | {"percent_rows", "currency_rows"}
+
+def load_template_spec(template_path: str) -> dict:
+    # The built-in TT spec, with whatever the template's .json overrides. Every
+    # malformed entry is reported at once, as a SpecError naming its section.
+    spec_path = _spec_path(template_path)
+    problems = []
+
+    def bad(section, message, **where):
+        problems.append(spec_problem("bad_template_spec", message, section=section, **where))
+
+    raw = {}
+    if os.path.exists(spec_path):
+        with open(spec_path) as fh:
+            try:
+                raw = json.load(fh)
+            except ValueError as e:
+                bad(None, f"not valid JSON ({e})")
+    if not isinstance(raw, dict):
+        bad(None, "must be a JSON object")
+        raw = {}
+    problems += [spec_problem("bad_template_spec", f"unknown section {name!r}", section=name)
+                 for name in raw if name not in ("placeholders", "grids", "slide_tables")]
+
+    placeholders = raw.get("placeholders", PLACEHOLDER_SPEC)
+    if not isinstance(placeholders, dict):
+        bad("placeholders", "must map keys to [sheet, cell, format]")
+        placeholders = {}
+    for key, entry in placeholders.items():
+        if not (isinstance(entry, (list, tuple)) and len(entry) == 3 and all(isinstance(part, str) for part in entry)):
+            bad("placeholders", f"{key}: expected [sheet, cell, format], got {entry!r}", key=key)
+            continue
+        _, ref, fmt = entry
+        if fmt not in PLACEHOLDER_FORMATS:
+            bad("placeholders", f"{key}: unknown format {fmt!r}", key=key)
+        try:
+            coordinate_from_string(ref)
+        except (ValueError, CellCoordinatesException):
+            bad("placeholders", f"{key}: bad cell reference {ref!r}", key=key)
+
+    grids = raw.get("grids", PLACEHOLDER_GRIDS)
+    if not isinstance(grids, (list, tuple)):
+        bad("grids", "must be a list")
+        grids = ()
+    for n, grid in enumerate(grids):
+        missing = ([field for field in ("sheet", "range", "key", "first_row", "row_formats") if field not in grid]
+                   if isinstance(grid, dict) else None)
+        if missing is None or missing:
+            bad("grids", f"grids[{n}]: " + (f"missing {', '.join(missing)}" if missing else "not an object"), index=n)
+            continue
+        try:
+            bounds = range_boundaries(grid["range"])
+        except (ValueError, TypeError):
+            bounds = (None,)
+        if None in bounds:
+            bad("grids", f"grids[{n}]: bad range {grid['range']!r}", index=n)
+            continue
+        if not isinstance(grid["sheet"], str):
+            bad("grids", f"grid {grid['range']}: bad sheet {grid['sheet']!r}", index=n)
+        if type(grid["first_row"]) is not int:
+            bad("grids", f"grid {grid['range']}: bad first_row {grid['first_row']!r}", index=n)
+        try:
+            grid["key"].format(col="A", row=1)
+        except (AttributeError, KeyError, IndexError, ValueError):
+            bad("grids", f"grid {grid['range']}: bad key {grid['key']!r}", index=n)
+        row_formats, rows = grid["row_formats"], bounds[3] - bounds[1] + 1
+        if not isinstance(row_formats, (list, tuple)) or len(row_formats) != rows:
+            bad("grids", f"grid {grid['range']}: row_formats needs one format per row ({rows})", index=n)
+            continue
+        problems += [spec_problem("bad_template_spec", f"grid {grid['range']}: unknown format {fmt!r}",
+                                  section="grids", index=n)
+                     for fmt in dict.fromkeys(row_formats) if fmt not in PLACEHOLDER_FORMATS]
+
+    slide_tables = raw.get("slide_tables", SLIDE_TABLES)
+    if not isinstance(slide_tables, (list, tuple)):
+        bad("slide_tables", "must be a list")
+        slide_tables = ()
+    for n, entry in enumerate(slide_tables):
+        missing = [field for field in ("slide", "sheet") if field not in entry] if isinstance(entry, dict) else None
+        if missing is None or missing:
+            bad("slide_tables", f"slide_tables[{n}]: " + (f"missing {', '.join(missing)}" if missing else "not an object"),
+                index=n)
+            continue
+        if type(entry["slide"]) is not int or entry["slide"] < 0:
+            bad("slide_tables", f"slide_tables[{n}]: bad slide {entry['slide']!r}", index=n)
+            continue
+        rules = entry.get("rules", {})
+        if not isinstance(rules, dict):
+            bad("slide_tables", f"slide {entry['slide']}: rules must be an object", index=n)
+        else:
+            problems += [spec_problem("bad_template_spec", f"slide {entry['slide']}: unknown rule {rule!r}",
+                                      section="slide_tables", index=n)
+                         for rule in rules if rule not in TABLE_RULES]
+        if "rows_per_slide" in entry:
+            per_slide = entry["rows_per_slide"]
+            if type(per_slide) is not int or per_slide < 1 + bool(entry.get("first_row_header")):
+                bad("slide_tables", f"slide {entry['slide']}: bad rows_per_slide {per_slide!r}", index=n)
+    if problems:
+        raise SpecError(problems, summary=f"Template spec {os.path.basename(spec_path)}")
+
+    return {
+        "placeholders": {key: tuple(entry) for key, entry in placeholders.items()},
+        "grids": tuple(grids),
+        # A table without "rules" gets its text as-is
+        "slide_tables": tuple({"rules": {}, **entry} for entry in slide_tables),
     }
 
-    # Replace placeholders across shapes and tables
-    for slide in prs.slides:
-        for shape in slide.shapes:
+def build_template_index(prs, placeholder_keys, table_slides) -> dict:
+    # Record where placeholders and target tables live so generation can jump
+    # straight to them instead of rescanning every shape on every slide.
+    pattern = compile_placeholders(placeholder_keys)
+    runs, cells, tables, keys, slide_keys = [], [], {}, set(), defaultdict(set)
+    table_sizes, slide_parts = {}, []
+
+    for slide_index, slide in enumerate(prs.slides):
+        slide_parts.append(slide.part.partname.lstrip("/"))
+        for shape_index, shape in enumerate(slide.shapes):
             if hasattr(shape, "text_frame") and shape.text_frame:
-                for paragraph in shape.text_frame.paragraphs:
-                    for run in paragraph.runs:
-                        for key, value in variable_mapping.items():
-                            if key in run.text:
-                                run.text = run.text.replace(key, str(value))
+                for paragraph_index, paragraph in enumerate(shape.text_frame.paragraphs):
+                    for run_index, run in enumerate(paragraph.runs):
+                        found = pattern.findall(run.text)
+                        if found:
+                            keys.update(found)
+                            slide_keys[slide_index].update(found)
+                            runs.append((slide_index, shape_index, paragraph_index, run_index))
 
             if getattr(shape, "has_table", False):
-                for row in shape.table.rows:
-                    for cell in row.cells:
-                        for key, value in variable_mapping.items():
-                            if key in cell.text:
-                                cell.text = cell.text.replace(key, str(value))
-                                for paragraph in cell.text_frame.paragraphs:
-                                    paragraph.alignment = PP_ALIGN.CENTER
-                                    for run in paragraph.runs:
-                                        run.font.name = "Roboto"
-                                        run.font.size = Pt(9)
-                                        run.font.color.rgb = RGBColor(0, 0, 0)
-
-    # Table copy/format rules
-    slides_to_update = {
-        9: df_sheet2,
-        11: df_drawdemos,
-        14: df_zipcodes,
-        36: df_distance,
-        37: df_frequency,
-        38: df_duration
+                for row_index, row in enumerate(shape.table.rows):
+                    for col_index, cell in enumerate(row.cells):
+                        found = pattern.findall(cell.text)
+                        if found:
+                            keys.update(found)
+                            slide_keys[slide_index].update(found)
+                            cells.append((slide_index, shape_index, row_index, col_index))
+                if slide_index in table_slides and slide_index not in tables:
+                    tables[slide_index] = shape_index
+                    table_sizes[slide_index] = (len(shape.table.rows), len(shape.table.columns))
+
+    return {
+        "runs": runs, "cells": cells, "tables": tables, "keys": sorted(keys),
+        "slide_keys": {slide: sorted(found) for slide, found in slide_keys.items()},
+        "table_sizes": table_sizes, "slide_parts": slide_parts,
     }
 
-    formatting_rules = {
-        "CompetitiveMarketPosition": {
-            "percent_columns": [3, 5, 6],
-            "currency_columns": [2],
-            "thousands_columns": [1]
-        },
-        "ZipCodes": {
-            "percent_columns": [4, 5, 8],
-            "currency_columns": [9],
-            "thousands_columns": [6, 7]
-        },
-        "DrawDemo": {
-            "percent_rows": [
-                "18-24", "25-34", "35-44", "45-54", "55-64", "65+",
-                "Less than $50,000", "$50,000-$74,999", "$75,000-$99,999",
-                "$100,000-$149,999", "$150,000 or more", "CHILDREN IN HOUSEHOLD",
-                "Less than college", "Some college", "College degree", "Post-graduate degree",
-                "Caucasian/White", "African-American/Black", "Hispanic/Latino",
-                "Asian", "Other"
-            ],
-            "currency_rows": ["HOUSEHOLD INCOME", "Average HH Income"]
-        },
-        "DistanceTravelled": {
-            "percent_columns": [1, 2, 3, 4, 5],
-            "decimal_columns": [6, 7]
-        },
-        "Frequency": {
-            "percent_columns": [1, 2, 3],
-            "decimal_columns": [4]
-        },
-        "Duration": {
-            "percent_columns": [1, 2, 3, 4],
-            "decimal_columns": [5]
-        }
+def _load_template_index(sha: str, blob: bytes, spec: dict) -> dict:
+    # The on-disk copy (keyed by template + spec hash) lets sibling workers
+    # skip the shape scan; otherwise scan and save it for them.
+    index_path = os.path.join(CACHE_DIR, f"template-index-{sha}.json")
+    if os.path.exists(index_path):
+        try:
+            with open(index_path) as fh:
+                raw = json.load(fh)
+            return {
+                "runs": [tuple(loc) for loc in raw["runs"]],
+                "cells": [tuple(loc) for loc in raw["cells"]],
+                "tables": {int(slide): shape for slide, shape in raw["tables"].items()},
+                "keys": raw["keys"],
+                "slide_keys": {int(slide): keys for slide, keys in raw["slide_keys"].items()},
+                "table_sizes": {int(slide): tuple(size) for slide, size in raw["table_sizes"].items()},
+                "slide_parts": raw["slide_parts"],
+            }
+        except (OSError, ValueError, KeyError):
+            pass
+
+    placeholder_keys = [key for key, *_ in spec_cells(spec["placeholders"], spec["grids"])]
+    prs = Presentation(io.BytesIO(blob))
+    index = build_template_index(prs, placeholder_keys, {entry["slide"] for entry in spec["slide_tables"]})
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(index, fh)
+    os.replace(tmp_path, index_path)
+    return index
+
+def compile_render_plan(template_path: str) -> dict:
+    # Everything generation needs from one template: its bytes and parsed
+    # package, its spec, where the placeholders and tables are, and the
+    # worksheet tabs/ranges that spec reads.
+    with open(template_path, "rb") as fh:
+        blob = fh.read()
+    spec = load_template_spec(template_path)
+    sha = hashlib.sha256(blob + json.dumps(spec, sort_keys=True).encode()).hexdigest()
+    index = _load_template_index(sha, blob, spec)
+    table_sheets = tuple(dict.fromkeys(entry["sheet"] for entry in spec["slide_tables"]))
+
+    # Which worksheet tabs each slide's content comes from
+    key_sheets = {key: sheet for key, sheet, *_ in spec_cells(spec["placeholders"], spec["grids"])}
+    slide_sheets = defaultdict(set)
+    for slide_index, keys in index["slide_keys"].items():
+        slide_sheets[slide_index].update(key_sheets[key] for key in keys)
+    for entry in spec["slide_tables"]:
+        if entry["slide"] in index["tables"]:
+            slide_sheets[entry["slide"]].add(entry["sheet"])
+
+    inc_metric("tt_template_plan_compiles_total", template=os.path.basename(template_path))
+    return {
+        **spec,
+        **index,
+        "path": template_path,
+        "sha256": sha,
+        "blob": blob,
+        "members": frozenset(zipfile.ZipFile(io.BytesIO(blob)).namelist()),
+        # Only ever deep-copied, never read: python-pptx caches proxies on
+        # first access, and a copy made after that would split the XML from
+        # the objects editing it.
+        "package": Presentation(io.BytesIO(blob)),
+        "keys": frozenset(index["keys"]),
+        "pattern": compile_placeholders(index["keys"]),
+        "table_sheets": table_sheets,
+        "slide_sheets": {slide_index: frozenset(sheets) for slide_index, sheets in slide_sheets.items()},
+        "ranges": spec_ranges(spec["placeholders"], spec["grids"], table_sheets),
     }
 
-    for slide_number, df_data in slides_to_update.items():
-        slide = prs.slides[slide_number]
-        sheet_name = [name for name, df in dfs.items() if df.equals(df_data)][0]
-        rules = formatting_rules.get(sheet_name, {})
-        table = next((s.table for s in slide.shapes if getattr(s, "has_table", False)), None)
-        if not table:
+# Render plans
+# Compiled once per version of a template (.pptx mtime/size plus its .json)
+# and kept in a per-process LRU, so a deployment serving many templates only
+# ever parses each one once per change.
+_template_plans = OrderedDict()
+_template_plans_lock = threading.Lock()
+
+def _template_stamp(template_path: str):
+    stat = os.stat(template_path)
+    spec_path = _spec_path(template_path)
+    spec_stat = os.stat(spec_path) if os.path.exists(spec_path) else None
+    return (stat.st_mtime_ns, stat.st_size, spec_stat and (spec_stat.st_mtime_ns, spec_stat.st_size))
+
+def get_render_plan(template_path: str) -> dict:
+    stamp = _template_stamp(template_path)
+    with _template_plans_lock:
+        cached = _template_plans.get(template_path)
+        if cached and cached[0] == stamp:
+            _template_plans.move_to_end(template_path)
+            return cached[1]
+
+    plan = compile_render_plan(template_path)
+    with _template_plans_lock:
+        _template_plans[template_path] = (stamp, plan)
+        _template_plans.move_to_end(template_path)
+        while len(_template_plans) > TEMPLATE_PLAN_CACHE_SIZE:
+            _template_plans.popitem(last=False)
+        set_metric("tt_template_plans", len(_template_plans))
+    flush_metrics()
+    return plan
+
+def open_template(template_path: str) -> Presentation:
+    # A private deep copy of the plan's parsed package: ~3x cheaper than
+    # re-reading the package from bytes.
+    return copy.deepcopy(get_render_plan(template_path)["package"])
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Worksheet loading
+_SSML = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_OFFICE_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+def _part_target(archive: zipfile.ZipFile, source: str, rel_id: str = None, rel_type: str = None) -> str:
+    # Resolve a relationship of `source` ("" for the package) to a zip member name
+    folder, name = posixpath.split(source)
+    rels = etree.fromstring(archive.read(posixpath.join(folder, "_rels", f"{name}.rels")))
+    for rel in rels.iter(f"{_PKG_REL}Relationship"):
+        if rel.get("Id") == rel_id or (rel_type and rel.get("Type").endswith(rel_type)):
+            target = rel.get("Target")
+            if target.startswith("/"):
+                return target[1:]
+            return posixpath.normpath(posixpath.join(folder, target))
+    raise KeyError(rel_id or rel_type)
+
+def _iter_shared_strings(archive: zipfile.ZipFile, workbook_part: str):
+    try:
+        part = _part_target(archive, workbook_part, rel_type="/sharedStrings")
+    except KeyError:
+        return
+    for _, si in etree.iterparse(archive.open(part), tag=f"{_SSML}si"):
+        # Plain <t> or rich-text runs <r><t>; phonetic hints (<rPh>) are skipped
+        text = "".join(t.text or "" for t in si.iter(f"{_SSML}t") if t.getparent().tag != f"{_SSML}rPh")
+        yield unescape(text)
+        si.clear()
+
+def _shared_strings(archive: zipfile.ZipFile, workbook_part: str) -> list:
+    return list(_iter_shared_strings(archive, workbook_part))
+
+class _SharedStringIndex(int):
+    """A text cell's shared-string index, read but not yet decoded."""
+
+class _UndecodedStrings:
+    """Stands in for the shared strings list, answering with the index."""
+
+    def __getitem__(self, index: int) -> _SharedStringIndex:
+        return _SharedStringIndex(index)
+
+def _xml_cell_value(cell, shared_strings):
+    # Same values openpyxl hands to pandas in read-only/values-only mode, minus
+    # style lookups: these tabs hold no dates, so number formats are ignored.
+    kind = cell.get("t", "n")
+    if kind == "inlineStr":
+        return "".join(cell.itertext())
+    value = cell.findtext(f"{_SSML}v") or None
+    if value is None:
+        return None
+    if kind == "s":
+        return shared_strings[int(value)]
+    if kind == "n":
+        return float(value) if any(ch in value for ch in ".eE") else int(value)
+    if kind == "b":
+        return value == "1"
+    if kind == "e":
+        return float("nan")
+    return value
+
+def _iter_sheet_rows(archive, part, shared_strings, max_row=None, columns=None):
+    # Stream <row> elements, yielding (row_number, {column_number: value});
+    # with `columns` (first, last), cells outside them are never decoded
+    row_number = 0
+    for _, row in etree.iterparse(archive.open(part), tag=f"{_SSML}row"):
+        row_number = int(row.get("r", row_number + 1))
+        values, col_number = {}, 0
+        for cell in row.iterchildren(f"{_SSML}c"):
+            ref = cell.get("r")
+            col_number = column_index_from_string(coordinate_from_string(ref)[0]) if ref else col_number + 1
+            if columns is None or columns[0] <= col_number <= columns[1]:
+                values[col_number] = _xml_cell_value(cell, shared_strings)
+        row.clear()
+        while row.getprevious() is not None:
+            del row.getparent()[0]
+        yield row_number, values
+        if max_row is not None and row_number >= max_row:
+            return
+
+def _read_range(archive, part, shared_strings, ref) -> dict:
+    # {(row, col): value} for the non-blank cells inside `ref`
+    min_col, min_row, max_col, max_row = range_boundaries(ref)
+    found = {}
+    for row_number, values in _iter_sheet_rows(archive, part, shared_strings, max_row, (min_col, max_col)):
+        if row_number < min_row:
             continue
+        for col_number, value in values.items():
+            if value is not None:
+                found[(row_number, col_number)] = value
+    return found
+
+def _read_table(archive, part, shared_strings) -> pd.DataFrame:
+    # Mirrors pandas' openpyxl reader (cell conversion, trailing trim, padding)
+    # and hands the rows to the same TextParser pd.read_excel uses.
+    data = []
+    for row_number, values in _iter_sheet_rows(archive, part, shared_strings):
+        while len(data) < row_number - 1:
+            data.append([])
+        row = [""] * (max(values) if values else 0)
+        for col_number, value in values.items():
+            if value is None:
+                continue
+            if isinstance(value, float) and value == value and int(value) == value:
+                value = int(value)
+            row[col_number - 1] = value
+        while row and row[-1] == "":
+            row.pop()
+        data.append(row)
+    while data and not data[-1]:
+        data.pop()
+    if not data:
+        return pd.DataFrame()
+    width = max(len(row) for row in data)
+    data = [row + [""] * (width - len(row)) for row in data]
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+def _sheet_parts(archive: zipfile.ZipFile):
+    # (workbook member, {sheet name: worksheet member}) from the workbook part
+    workbook_part = _part_target(archive, "", rel_type="/officeDocument")
+    workbook = etree.fromstring(archive.read(workbook_part))
+    parts = {
+        sheet.get("name"): _part_target(archive, workbook_part, rel_id=sheet.get(f"{_OFFICE_REL}id"))
+        for sheet in workbook.iter(f"{_SSML}sheet")
+    }
+    return workbook_part, parts
+
+def load_worksheet(xlsm_path: str, ranges: dict = None, table_sheets=None):
+    # Stream only the tabs we need straight out of the zip: DataFrames for the
+    # table tabs, {(row, col): value} for the cell ranges the placeholder spec
+    # reads. Styles, defined names and every other tab are never parsed.
+    ranges = spec_ranges() if ranges is None else ranges
+    table_sheets = TABLE_SHEETS if table_sheets is None else table_sheets
+    with zipfile.ZipFile(xlsm_path) as archive:
+        workbook_part, parts = _sheet_parts(archive)
+        missing = [name for name in (*ranges, *table_sheets) if name not in parts]
+        if missing:
+            raise SpecError([spec_problem("missing_sheet", f"sheet {name} is missing", sheet=name) for name in missing])
 
-        rows, cols = df_data.shape
-
-        # Header styling where needed
-        if sheet_name in ("DrawDemo", "DistanceTravelled", "Frequency", "Duration", "CompetitiveMarketPosition"):
-            for col_index, col_name in enumerate(df_data.columns):
-                if col_index < len(table.columns):
-                    cell = table.cell(0, col_index)
-                    cell.text = str(col_name)
-                    for paragraph in cell.text_frame.paragraphs:
-                        paragraph.alignment = PP_ALIGN.CENTER if col_index == 0 else PP_ALIGN.LEFT
-                        for run in paragraph.runs:
-                            run.font.name = "Roboto"
-                            run.font.size = Pt(9)
-                            run.font.color.rgb = RGBColor(255, 255, 255)
-                            run.font.bold = True
-
-        for row_index in range(min(rows, len(table.rows) - 1)):
-            for col_index in range(min(cols, len(table.columns))):
-                value = df_data.iloc[row_index, col_index]
-                value = "" if pd.isna(value) else value
-                row_label = str(df_data.iloc[row_index, 0])
-
-                if isinstance(value, (int, float)):
-                    if sheet_name == "DrawDemo":
-                        if any(keyword in row_label for keyword in rules.get("percent_rows", [])):
-                            formatted_value = f"{round(value * 100, 1)}%"
-                        elif any(keyword in row_label for keyword in rules.get("currency_rows", [])):
-                            formatted_value = "${:,.0f}".format(value)
-                        else:
-                            formatted_value = str(value)
-                    else:
-                        if col_index in rules.get("percent_columns", []):
-                            formatted_value = f"{round(value * 100, 1)}%"
-                        elif col_index in rules.get("currency_columns", []):
-                            formatted_value = "${:,.0f}".format(value)
-                        elif col_index in rules.get("thousands_columns", []):
-                            formatted_value = "{:,.0f}".format(value)
-                        elif col_index in rules.get("decimal_columns", []):
-                            formatted_value = f"{value:.1f}"
-                        else:
-                            formatted_value = str(value)
-                else:
-                    formatted_value = str(value)
-
-                cell = table.cell(row_index + 1, col_index)
-                cell.text = formatted_value
-                for paragraph in cell.text_frame.paragraphs:
-                    for run in paragraph.runs:
-                        run.font.name = "Roboto"
-                        run.font.size = Pt(9)
-                        if sheet_name in ("DistanceTravelled", "Frequency", "Duration") and row_index == 0:
-                            run.font.color.rgb = RGBColor(255, 255, 255)
-                            run.font.bold = True
-                        else:
-                            run.font.color.rgb = RGBColor(0, 0, 0)
+        shared_strings = _shared_strings(archive, workbook_part)
+        cells = {
+            name: _read_range(archive, parts[name], shared_strings, ref)
+            for name, ref in ranges.items()
+        }
+        tables = {name: _read_table(archive, parts[name], shared_strings) for name in table_sheets}
+    return tables, cells
+
+def _inside_table(archive, part, row, col) -> bool:
+    # Whether an empty cell is still inside the DataFrame _read_table builds:
+    # some row at or below it holds a value, and so does some column at or
+    # right of it. Rows are streamed only until both turn up.
+    below = right = False
+    for row_number, values in _iter_sheet_rows(archive, part, _UndecodedStrings()):
+        filled = [col_number for col_number, value in values.items() if value not in (None, "")]
+        below = below or (row_number >= row and bool(filled))
+        right = right or any(col_number >= col for col_number in filled)
+        if below and right:
+            return True
+    return False
+
+def validate_worksheet(xlsm_path: str, plan: dict) -> list:
+    # The fail-fast pre-pass: every problem with the sheet list and the
+    # placeholder cells, read from the workbook part and just the cell ranges
+    # (rows past them are never parsed). A spec cell on a table tab is only
+    # checked to be inside the tab's data, read from the header row down to
+    # it; its value gets pandas' type inference once the tab is loaded.
+    spec = {key: entry for key, entry in plan["placeholders"].items() if entry[0] not in plan["table_sheets"]}
+    grids = [grid for grid in plan["grids"] if grid["sheet"] not in plan["table_sheets"]]
+    table_cells = [cell for cell in spec_cells(plan["placeholders"], plan["grids"]) if cell[1] in plan["table_sheets"]]
+    table_bounds = {}
+    for _, sheet, row, col, _ in table_cells:
+        last_row, last_col = table_bounds.get(sheet, (1, 1))
+        table_bounds[sheet] = (max(last_row, row), max(last_col, col))
+    try:
+        with zipfile.ZipFile(xlsm_path) as archive:
+            workbook_part, parts = _sheet_parts(archive)
+            cells = {
+                name: _read_range(archive, parts[name], _UndecodedStrings(), ref)
+                for name, ref in plan["ranges"].items() if name in parts
+            }
+            tables = {
+                name: _read_range(archive, parts[name], _UndecodedStrings(), f"A1:{get_column_letter(col)}{row}")
+                for name, (row, col) in table_bounds.items() if name in parts
+            }
+            # Text only matters where the spec wants a number (it ends up in
+            # the problem message), so only those strings are decoded
+            wanted = {
+                (sheet, row, col): value for _, sheet, row, col, fmt in spec_cells(spec, grids)
+                if fmt != "raw" and isinstance(value := cells.get(sheet, {}).get((row, col)), _SharedStringIndex)
+            }
+            if wanted:
+                strings = list(itertools.islice(_iter_shared_strings(archive, workbook_part),
+                                                max(wanted.values()) + 1))
+                for (sheet, row, col), index in wanted.items():
+                    cells[sheet][(row, col)] = strings[index]
+
+            table_problems = []
+            for key, sheet, row, col, fmt in table_cells:
+                if sheet not in tables or (row, col) in tables[sheet]:
+                    continue
+                cell = f"{get_column_letter(col)}{row}"
+                where = {"key": key, "sheet": sheet, "cell": cell}
+                if row < 2 or not _inside_table(archive, parts[sheet], row, col):
+                    table_problems.append(spec_problem(
+                        "out_of_range", f"{key}: {sheet}!{cell} is outside the data on {sheet}", **where))
+                elif fmt != "raw":
+                    table_problems.append(spec_problem(
+                        "blank", f"{key}: {sheet}!{cell} is blank, expected a number", **where))
+    except (zipfile.BadZipFile, KeyError, IndexError, etree.XMLSyntaxError):
+        return [spec_problem("unreadable", "The file isn't a readable .xlsm/.xlsx workbook")]
+
+    sheets = dict.fromkeys([*plan["ranges"], *plan["table_sheets"]])
+    problems = [spec_problem("missing_sheet", f"sheet {name} is missing", sheet=name)
+                for name in sheets if name not in parts]
+    problems += [problem for problem in check_spec({}, cells, spec, grids) if problem["code"] != "missing_sheet"]
+    problems += table_problems
+    return problems
+
+# Package output
+# Generation only edits text inside slide XML, so the output zip is the
+# template zip with those slide members swapped out. Everything else (media,
+# layouts, masters, themes) is copied still compressed, never re-serialized.
+_ZIP_LOCAL = struct.Struct("<4s2B4HL2L2H")
+_ZIP_CENTRAL = struct.Struct("<4s4B4HL2L5H2L")
+_ZIP_END = struct.Struct("<4s4H2LH")
+_ZIP_UTF8 = 0x800
+_ADDED_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((max(year, 1980) - 1980) << 9) | (month << 5) | day
+
+def write_package(template_blob: bytes, replacements: dict, output):
+    # Copies each template member's compressed bytes verbatim, except members
+    # named in `replacements` ({name: new bytes}), which are deflated afresh,
+    # or left out when mapped to None. Replacements the template doesn't have
+    # are added after its members.
+    source = zipfile.ZipFile(io.BytesIO(template_blob))
+    infos = [info for info in source.infolist() if replacements.get(info.filename, b"") is not None]
+    added = [name for name, data in replacements.items() if name not in source.NameToInfo and data is not None]
+    if len(infos) + len(added) >= 0xFFFF or len(template_blob) >= 0x7FFFFFFF:
+        raise ValueError("zip64 templates are not supported")
+    central = []
+    for info in infos + [zipfile.ZipInfo(name, date_time=_ADDED_DATE_TIME) for name in added]:
+        if info.filename in added:
+            name = info.filename.encode()
+        else:
+            # The name exactly as the template stores it
+            name_start = info.header_offset + _ZIP_LOCAL.size
+            name_len, extra_len = struct.unpack_from("<2H", template_blob, info.header_offset + 26)
+            name = template_blob[name_start:name_start + name_len]
+        if info.filename in replacements:
+            data = replacements[info.filename]
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            payload = compressor.compress(data) + compressor.flush()
+            compress_type, crc, file_size = zipfile.ZIP_DEFLATED, zlib.crc32(data), len(data)
+        else:
+            data_start = name_start + name_len + extra_len
+            payload = memoryview(template_blob)[data_start:data_start + info.compress_size]
+            compress_type, crc, file_size = info.compress_type, info.CRC, info.file_size
+        # Sizes always go in the local header, so no data descriptors
+        flags = info.flag_bits & _ZIP_UTF8
+        extract_version = max(info.extract_version, 20)
+        dos_time, dos_date = _dos_datetime(info.date_time)
+        offset = output.tell()
+        output.write(_ZIP_LOCAL.pack(
+            b"PK\x03\x04", extract_version, 0, flags, compress_type, dos_time, dos_date,
+            crc, len(payload), file_size, len(name), 0,
+        ))
+        output.write(name)
+        output.write(payload)
+        central.append(_ZIP_CENTRAL.pack(
+            b"PK\x01\x02", info.create_version, info.create_system, extract_version, 0, flags, compress_type,
+            dos_time, dos_date, crc, len(payload), file_size, len(name), 0, 0, 0,
+            info.internal_attr, info.external_attr, offset,
+        ) + name)
+    directory_offset = output.tell()
+    for entry in central:
+        output.write(entry)
+    output.write(_ZIP_END.pack(
+        b"PK\x05\x06", 0, 0, len(central), len(central), output.tell() - directory_offset, directory_offset, 0,
+    ))
+
+_PML_SLIDE = "application/vnd.openxmlformats-officedocument.presentationml.slide+xml"
+_CT = "{http://schemas.openxmlformats.org/package/2006/content-types}"
+_PML = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+_SLIDE_MEMBER = re.compile(r"ppt/slides/slide(\d+)\.xml")
+
+def _rels_member(member: str) -> str:
+    return posixpath.join(posixpath.dirname(member), "_rels", f"{posixpath.basename(member)}.rels")
+
+def _slide_list(archive: zipfile.ZipFile):
+    # (presentation member, its parsed XML and rels, [(sldId, slide member)])
+    presentation_part = _part_target(archive, "", rel_type="/officeDocument")
+    presentation = etree.fromstring(archive.read(presentation_part))
+    presentation_rels = etree.fromstring(archive.read(_rels_member(presentation_part)))
+    targets = {
+        rel.get("Id"): posixpath.normpath(posixpath.join(posixpath.dirname(presentation_part), rel.get("Target")))
+        for rel in presentation_rels
+    }
+    slides = [(entry, targets[entry.get(f"{_OFFICE_REL}id")]) for entry in presentation.find(f"{_PML}sldIdLst")]
+    return presentation_part, presentation, presentation_rels, slides
+
+def continuation_slides(deck_blob: bytes, slide_members) -> dict:
+    # {source slide member: [{"member", "rel_id", "slide_id"}]} for a deck's
+    # continuation slides: each slide that isn't one of the template's
+    # `slide_members` continues the template slide listed before it
+    slide_members = set(slide_members)
+    found, source = {}, None
+    with zipfile.ZipFile(io.BytesIO(deck_blob)) as archive:
+        for entry, member in _slide_list(archive)[3]:
+            if member in slide_members:
+                source = member
+            elif source is not None:
+                found.setdefault(source, []).append(
+                    {"member": member, "rel_id": entry.get(f"{_OFFICE_REL}id"), "slide_id": entry.get("id")}
+                )
+    return found
+
+def continuation_parts(base_blob: bytes, pages: dict, stale=()) -> dict:
+    # Members that add each continuation page ({slide member: [slide XML]}) as
+    # a new slide right after its source slide: the slides and their rels
+    # (the source's, minus its notes), and the content types, presentation
+    # rels and slide list that register them. `stale` continuation slides
+    # (as listed by continuation_slides) are taken out first.
+    if not pages and not stale:
+        return {}
+    archive = zipfile.ZipFile(io.BytesIO(base_blob))
+    presentation_part, presentation, presentation_rels, slides = _slide_list(archive)
+    content_types = etree.fromstring(archive.read("[Content_Types].xml"))
+    slide_list = presentation.find(f"{_PML}sldIdLst")
+
+    # Dropped ids and member numbers aren't reused, so nothing added below
+    # can collide with a member that is being removed
+    rel_ids = {rel.get("Id") for rel in presentation_rels}
+    next_slide_id = max(int(entry.get("id")) for entry, _ in slides) + 1
+    slide_numbers = [_SLIDE_MEMBER.fullmatch(name) for name in archive.namelist()]
+    next_member = max(int(match.group(1)) for match in slide_numbers if match) + 1
+    next_rel = 1
+
+    parts = {}
+    stale_members = {record["member"] for record in stale}
+    stale_rels = {record["rel_id"] for record in stale}
+    for member in stale_members:
+        parts[member] = parts[_rels_member(member)] = None
+    for entry, member in slides:
+        if member in stale_members:
+            slide_list.remove(entry)
+    for rel in list(presentation_rels):
+        if rel.get("Id") in stale_rels:
+            presentation_rels.remove(rel)
+    for override in list(content_types):
+        if override.get("PartName", "").lstrip("/") in stale_members:
+            content_types.remove(override)
+
+    slide_ids = {member: entry for entry, member in slides}
+    for member, page_xmls in pages.items():
+        slide_rels = etree.fromstring(archive.read(_rels_member(member)))
+        for rel in list(slide_rels):
+            if rel.get("Type").endswith("/notesSlide"):
+                slide_rels.remove(rel)
+        slide_rels = serialize_part_xml(slide_rels)
+
+        anchor = slide_ids[member]
+        for page_xml in page_xmls:
+            new_member = f"ppt/slides/slide{next_member}.xml"
+            next_member += 1
+            while f"rId{next_rel}" in rel_ids:
+                next_rel += 1
+            rel_id = f"rId{next_rel}"
+            rel_ids.add(rel_id)
+
+            parts[new_member] = page_xml
+            parts[_rels_member(new_member)] = slide_rels
+            etree.SubElement(content_types, f"{_CT}Override", PartName=f"/{new_member}", ContentType=_PML_SLIDE)
+            etree.SubElement(
+                presentation_rels, f"{_PKG_REL}Relationship", Id=rel_id, Type=RT.SLIDE,
+                Target=posixpath.relpath(new_member, posixpath.dirname(presentation_part)),
+            )
+            entry = etree.Element(f"{_PML}sldId", {"id": str(next_slide_id), f"{_OFFICE_REL}id": rel_id})
+            next_slide_id += 1
+            anchor.addnext(entry)
+            anchor = entry
+
+    parts["[Content_Types].xml"] = serialize_part_xml(content_types)
+    parts[_rels_member(presentation_part)] = serialize_part_xml(presentation_rels)
+    parts[presentation_part] = serialize_part_xml(presentation)
+    return parts
+
+def save_presentation(prs, plan: dict, slide_indexes, output, pages: dict = None):
+    # Patch the template zip with just the slides generation touched, plus any
+    # continuation pages; fall back to a full prs.save if the package no
+    # longer has the template's parts.
+    template_blob, members = plan["blob"], plan["members"]
+    partnames = {part.partname.lstrip("/") for part in prs.part.package.iter_parts()}
+    replacements = _slide_blobs(prs, slide_indexes)
+    if partnames <= members and set(replacements) <= members:
+        try:
+            write_package(template_blob, {**replacements, **continuation_parts(template_blob, pages)}, output)
+            return
+        except ValueError:
+            output.seek(0)
+            output.truncate()
+    if not pages:
+        prs.save(output)
+        return
+    saved = io.BytesIO()
+    prs.save(saved)
+    write_package(saved.getvalue(), continuation_parts(saved.getvalue(), pages), output)
+
+# Slide rendering
+# Each slide's edits are computed up front (prepare_slides) and applied by
+# fill_slide, either to the request's copy of the package or, with
+# RENDER_WORKERS > 1, to raw slide parts in a process pool. Pools are keyed
+# by pid: a forked gunicorn worker starts its own rather than inheriting the
+# parent's, whose management threads didn't survive the fork.
+_render_executors = {}
+_render_executors_lock = threading.Lock()
+
+def paginate_rows(body: np.ndarray, per_page: int, repeat_first: bool) -> list:
+    # Formatted table rows split into one block per slide; a header-styled
+    # first row is repeated at the top of every block
+    head, rest = (body[:1], body[1:]) if repeat_first else (body[:0], body)
+    per_page = max(per_page - len(head), 1)
+    if len(rest) <= per_page:
+        return [body]
+    return [np.concatenate([head, rest[start:start + per_page]]) for start in range(0, len(rest), per_page)]
+
+def prepare_slides(plan: dict, dfs: dict, cells: dict, timer: StageTimer, slides=None):
+    # (substitutions, {slide index: work}) where work lists the runs and cells
+    # to substitute and the already formatted text of each table to fill.
+    # Table rows past the slide's row budget go to "pages", one list of
+    # tables per continuation slide. With `slides`, only those slide indexes
+    # get work.
+    wanted = lambda slide_index: slides is None or slide_index in slides
+    work = defaultdict(lambda: {"runs": [], "cells": [], "tables": [], "pages": []})
+
+    # Only placeholders the template actually contains get formatted
+    with timer.stage("mapping"):
+        variable_mapping = build_variable_mapping(
+            dfs, cells, keys=plan["keys"], spec=plan["placeholders"], grids=plan["grids"]
+        )
+        substitutions = {key: str(value) for key, value in variable_mapping.items()}
+        for slide_index, *location in plan["runs"]:
+            if wanted(slide_index):
+                work[slide_index]["runs"].append(tuple(location))
+        for slide_index, *location in plan["cells"]:
+            if wanted(slide_index):
+                work[slide_index]["cells"].append(tuple(location))
+
+    # Worksheet tabs formatted for their slide tables
+    with timer.stage("tables"):
+        for entry in plan["slide_tables"]:
+            slide_number, df_data, rules = entry["slide"], dfs[entry["sheet"]], entry["rules"]
+            if slide_number not in plan["tables"] or not wanted(slide_number):
+                continue
+            table_rows, table_cols = plan["table_sizes"][slide_number]
+            rows, cols = df_data.shape
+            header = []
+            if entry.get("header"):
+                header = [(col_index, str(col_name)) for col_index, col_name in enumerate(df_data.columns)
+                          if col_index < table_cols]
+            body = format_table(df_data, rules, rows, min(cols, table_cols))
+            # The tab's table ends at its first blank row (links and other
+            # blocks follow it); only rows before that can overflow
+            blank = np.flatnonzero(~(body != "").any(axis=1))
+            body = body[:max(blank[0] if len(blank) else rows, min(rows, table_rows - 1))]
+            first_row_header = bool(entry.get("first_row_header"))
+            pages = paginate_rows(body, entry.get("rows_per_slide", table_rows - 1), first_row_header)
+            table_work = {
+                "shape": plan["tables"][slide_number],
+                "header": header,
+                "body": pages[0],
+                "first_row_header": first_row_header,
+            }
+            slide_work = work[slide_number]
+            slide_work["tables"].append(table_work)
+            for page_index, page in enumerate(pages[1:]):
+                if page_index == len(slide_work["pages"]):
+                    slide_work["pages"].append([])
+                slide_work["pages"][page_index].append({**table_work, "body": page})
+    return substitutions, dict(work)
+
+_CONTROL_CHARS = re.compile(r"[\x00-\x1f]")
+_XMLNS = re.compile(r' xmlns(?::\w+)?="[^"]*"')
+_SENTINEL = "\ue000"
+
+def _fragment(element) -> str:
+    # `element` as XML text without the namespace declarations on its own tag,
+    # for splicing into a document that already declares them
+    xml = etree.tostring(element, encoding="unicode")
+    end = xml.index(">")
+    return _XMLNS.sub("", xml[:end]) + xml[end:]
+
+def _cell_xml(tc, text: str, style: str, key, prototypes: dict) -> str:
+    # What set_cell_text would make of `tc`, as XML text. Each template
+    # cell/style (by `key`) is rendered once around a placeholder character;
+    # after that a cell is one string concatenation.
+    if _CONTROL_CHARS.search(text):
+        filled = copy.deepcopy(tc)
+        set_cell_text(_Cell(filled, None), text, style)
+        return _fragment(filled)
+    key = (key, style, text == "")
+    if key not in prototypes:
+        filled = copy.deepcopy(tc)
+        set_cell_text(_Cell(filled, None), "" if text == "" else _SENTINEL, style)
+        prototypes[key] = _fragment(filled).split(_SENTINEL)
+    parts = prototypes[key]
+    if text == "":
+        return parts[0]
+    return parts[0] + text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;") + parts[1]
+
+def _row_xml(tr, row_text, style: str, grown: bool, prototypes: dict) -> str:
+    # One body row as XML text, patterned on template row `tr`. Template rows
+    # with the same XML share prototypes; rows added past the template's own
+    # drop its a:extLst (row ids must stay unique).
+    key = (etree.tostring(tr), grown)
+    if key not in prototypes:
+        children = [child for child in tr if not (grown and child.tag == qn("a:extLst"))]
+        tcs = [child for child in children if child.tag == qn("a:tc")]
+        prototypes[key] = (
+            _fragment(etree.Element(tr.tag, tr.attrib))[:-2] + ">",
+            tcs,
+            [_fragment(child) for child in children if child not in tcs[:len(row_text)]],
+        )
+    open_tag, tcs, rest = prototypes[key]
+    cells = [_cell_xml(tc, text, style, (key, col_index), prototypes)
+             for col_index, (tc, text) in enumerate(zip(tcs, row_text))]
+    return open_tag + "".join(cells) + "".join(rest) + f"</{tr.prefix}:tr>"
+
+def fill_table(graphic_frame, table_work: dict):
+    # Header cells, then the whole body built as XML text and parsed into the
+    # table in one go. Rows past the template table's are patterned on its
+    # last row, and the frame grows to fit them.
+    table = graphic_frame.table
+    for col_index, col_name in table_work["header"]:
+        alignment = PP_ALIGN.CENTER if col_index == 0 else PP_ALIGN.LEFT
+        set_cell_text(table.cell(0, col_index), col_name, "header", alignment)
+
+    tbl, body = table._tbl, table_work["body"]
+    if not len(body):
+        return
+    rows, prototypes, row_xml = tbl.tr_lst, {}, []
+    for row_index, row_text in enumerate(body):
+        grown = row_index + 1 >= len(rows)
+        style = "header" if table_work["first_row_header"] and row_index == 0 else "body"
+        row_xml.append(_row_xml(rows[-1] if grown else rows[row_index + 1], row_text, style, grown, prototypes))
+
+    namespaces = " ".join(f'xmlns{":" + prefix if prefix else ""}="{uri}"' for prefix, uri in tbl.nsmap.items())
+    filled = parse_xml(f"<{tbl.prefix}:tbl {namespaces}>{''.join(row_xml)}</{tbl.prefix}:tbl>")
+    start = tbl.index(rows[0]) + 1
+    tbl[start:start + min(len(body), len(rows) - 1)] = list(filled)
+    if len(body) >= len(rows):
+        graphic_frame.height = Emu(sum(tr.h for tr in tbl.tr_lst))
+
+def fill_slide(shapes: list, work: dict, substitutions: dict, pattern):
+    # Replace placeholders across shapes and tables (one regex pass per run/cell)
+    replace = lambda match: substitutions[match.group(0)]
+    for shape_index, paragraph_index, run_index in work["runs"]:
+        run = shapes[shape_index].text_frame.paragraphs[paragraph_index].runs[run_index]
+        text, count = pattern.subn(replace, run.text)
+        if count:
+            run.text = text
+
+    for shape_index, row_index, col_index in work["cells"]:
+        cell = shapes[shape_index].table.cell(row_index, col_index)
+        text, count = pattern.subn(replace, cell.text)
+        if count:
+            set_cell_text(cell, text, "body", PP_ALIGN.CENTER)
+
+    # Copy worksheet tabs into their slide tables, header styling where needed
+    for table_work in work["tables"]:
+        fill_table(shapes[table_work["shape"]], table_work)
+
+def fill_continuations(plan: dict, slide_index: int, work: dict, substitutions: dict) -> list:
+    # One filled copy of the template slide per continuation page: the same
+    # placeholders, with that page's table rows
+    if not work["pages"]:
+        return []
+    with zipfile.ZipFile(io.BytesIO(plan["blob"])) as archive:
+        slide_xml = archive.read(plan["slide_parts"][slide_index])
+    parts = []
+    for tables in work["pages"]:
+        slide = parse_xml(slide_xml)
+        page_work = {"runs": work["runs"], "cells": work["cells"], "tables": tables}
+        fill_slide(list(SlideShapes(slide.cSld.spTree, None)), page_work, substitutions, plan["pattern"])
+        parts.append(serialize_part_xml(slide))
+    return parts
+
+def render_slides(prs, plan: dict, dfs: dict, cells: dict, timer: StageTimer, slides=None):
+    # Fill `prs`, a fresh copy of the plan's package, in place; with `slides`,
+    # only those slide indexes. Returns the slide indexes that were filled and
+    # the continuation pages ({slide member: [slide XML]}) of those that overflowed.
+    substitutions, work = prepare_slides(plan, dfs, cells, timer, slides)
+    pages = {}
+    with timer.stage("slides"):
+        for slide_index, slide_work in work.items():
+            fill_slide(list(prs.slides[slide_index].shapes), slide_work, substitutions, plan["pattern"])
+            if slide_work["pages"]:
+                member = plan["slide_parts"][slide_index]
+                pages[member] = fill_continuations(plan, slide_index, slide_work, substitutions)
+    return set(work), pages
+
+def _render_executor(workers: int) -> ProcessPoolExecutor:
+    key = (os.getpid(), workers)
+    with _render_executors_lock:
+        if key not in _render_executors:
+            _render_executors[key] = ProcessPoolExecutor(max_workers=workers)
+        return _render_executors[key]
+
+def _render_slide_part(template_path: str, plan_sha: str, slide_index: int, work: dict, substitutions: dict) -> list:
+    # Runs inside a render pool process: fill one slide straight from the
+    # template's XML for it and return the part as it would be saved,
+    # followed by its continuation pages.
+    plan = get_render_plan(template_path)
+    if plan["sha256"] != plan_sha:
+        raise RuntimeError("Template changed while the report was rendering")
+    with zipfile.ZipFile(io.BytesIO(plan["blob"])) as archive:
+        slide = parse_xml(archive.read(plan["slide_parts"][slide_index]))
+    fill_slide(list(SlideShapes(slide.cSld.spTree, None)), work, substitutions, plan["pattern"])
+    return [serialize_part_xml(slide)] + fill_continuations(plan, slide_index, work, substitutions)
+
+def render_slide_parts(plan: dict, dfs: dict, cells: dict, timer: StageTimer, workers: int, slides=None):
+    # The parallel counterpart of render_slides: {zip member: slide XML} for
+    # every slide that has work, each filled in a render pool process, and
+    # the continuation pages.
+    substitutions, work = prepare_slides(plan, dfs, cells, timer, slides)
+    with timer.stage("slides"):
+        args = [(plan["path"], plan["sha256"], slide_index, slide_work, substitutions)
+                for slide_index, slide_work in sorted(work.items())]
+        try:
+            futures = [_render_executor(workers).submit(_render_slide_part, *arg) for arg in args]
+            parts = [future.result() for future in futures]
+        except BrokenProcessPool:
+            with _render_executors_lock:
+                _render_executors.pop((os.getpid(), workers), None)
+            raise
+    members = [plan["slide_parts"][arg[2]] for arg in args]
+    replacements = {member: part[0] for member, part in zip(members, parts)}
+    pages = {member: part[1:] for member, part in zip(members, parts) if len(part) > 1}
+    return replacements, pages
+
+def _slide_blobs(prs, slide_indexes) -> dict:
+    blobs = {}
+    for slide_index in slide_indexes:
+        part = prs.slides[slide_index].part
+        blobs[part.partname.lstrip("/")] = part.blob
+    return blobs
+
+def require_valid_worksheet(xlsm_path: str, plan: dict):
+    # Raise SpecError with every problem validate_worksheet finds, before the
+    # workbook is parsed in full or anything is rendered
+    problems = validate_worksheet(xlsm_path, plan)
+    if problems:
+        raise SpecError(problems)
+
+def build_presentation(xlsm_path: str, template_path: str, timer: StageTimer = None,
+                       workers: int = None) -> io.BytesIO:
+    timer = timer or StageTimer()
+    workers = RENDER_WORKERS if workers is None else workers
+
+    # Load template PPT (the pool processes have their own copy of the plan)
+    with timer.stage("template_load"):
+        plan = get_render_plan(template_path)
+        prs = copy.deepcopy(plan["package"]) if workers <= 1 else None
+
+    with timer.stage("validate"):
+        require_valid_worksheet(xlsm_path, plan)
+
+    # Read Excel sheets (openpyxl reads .xlsm/.xlsx; macros aren’t executed)
+    with timer.stage("worksheet_parse"):
+        dfs, cells = load_worksheet(xlsm_path, plan["ranges"], plan["table_sheets"])
+
+    if workers > 1:
+        replacements, pages = render_slide_parts(plan, dfs, cells, timer, workers)
+    else:
+        touched, pages = render_slides(prs, plan, dfs, cells, timer)
 
     # Write PPT to memory buffer and return
-    output = io.BytesIO()
-    prs.save(output)
-    output.seek(0)
+    with timer.stage("save"):
+        output = io.BytesIO()
+        if workers > 1:
+            write_package(plan["blob"], {**replacements, **continuation_parts(plan["blob"], pages)}, output)
+        else:
+            save_presentation(prs, plan, touched, output, pages)
+        output.seek(0)
     return output
 
+# Incremental reports
+_REPORT_ID = re.compile(r"[A-Za-z0-9_.-]{1,64}")
+
+def valid_report_id(report_id: str) -> bool:
+    return bool(_REPORT_ID.fullmatch(report_id)) and report_id not in (".", "..")
+
+def sheet_hashes(tables: dict, cells: dict) -> dict:
+    # A digest of the values generation reads from each tab
+    hashes = {}
+    for name, df in tables.items():
+        hashes[name] = hashlib.sha256(repr((list(df.columns), df.to_numpy(dtype=object).tolist())).encode()).hexdigest()
+    for name, values in cells.items():
+        hashes[name] = hashlib.sha256(repr(sorted(values.items())).encode()).hexdigest()
+    return hashes
+
+def _expire_reports():
+    if not os.path.isdir(REPORTS_DIR):
+        return
+    cutoff = time.time() - REPORT_TTL_SECONDS
+    for name in os.listdir(REPORTS_DIR):
+        path = os.path.join(REPORTS_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def _load_report(report_id: str, plan: dict):
+    # (previous deck bytes, its state), or None when there is nothing usable:
+    # no earlier run, another template or code version, or a torn write
+    report_dir = os.path.join(REPORTS_DIR, report_id)
+    try:
+        with open(os.path.join(report_dir, "state.json")) as fh:
+            state = json.load(fh)
+        with open(os.path.join(report_dir, "deck.pptx"), "rb") as fh:
+            deck = fh.read()
+    except (OSError, ValueError):
+        return None
+    if (state.get("plan"), state.get("code")) != (plan["sha256"], CODE_VERSION):
+        return None
+    if hashlib.sha256(deck).hexdigest() != state.get("deck"):
+        return None
+    return deck, state
+
+def _save_report(report_id: str, plan: dict, deck: bytes, hashes: dict):
+    # The state also lists each paginated slide's continuation slides, so a
+    # rebuild of that slide can take them out again
+    report_dir = os.path.join(REPORTS_DIR, report_id)
+    os.makedirs(report_dir, exist_ok=True)
+    _write_result(os.path.join(report_dir, "deck.pptx"), deck)
+    state = {
+        "plan": plan["sha256"], "code": CODE_VERSION, "deck": hashlib.sha256(deck).hexdigest(), "sheets": hashes,
+        "continuations": continuation_slides(deck, plan["slide_parts"]),
+    }
+    _write_result(os.path.join(report_dir, "state.json"), json.dumps(state).encode())
+
+def build_incremental(xlsm_path: str, template_path: str, report_id: str, timer: StageTimer = None,
+                      workers: int = None):
+    # Like build_presentation, but keeps the deck under `report_id` and, on the
+    # next upload, re-renders only the slides whose source tabs changed and
+    # splices them into that earlier deck. Returns (output, slide report).
+    timer = timer or StageTimer()
+    workers = RENDER_WORKERS if workers is None else workers
+    _expire_reports()
+
+    with timer.stage("template_load"):
+        plan = get_render_plan(template_path)
+        prs = copy.deepcopy(plan["package"]) if workers <= 1 else None
+        previous = _load_report(report_id, plan)
+
+    with timer.stage("validate"):
+        require_valid_worksheet(xlsm_path, plan)
+
+    with timer.stage("worksheet_parse"):
+        dfs, cells = load_worksheet(xlsm_path, plan["ranges"], plan["table_sheets"])
+        hashes = sheet_hashes(dfs, cells)
+
+    dependent = set(plan["slide_sheets"])
+    if previous is None:
+        slides = None
+    else:
+        changed = {sheet for sheet, digest in hashes.items() if previous[1]["sheets"].get(sheet) != digest}
+        slides = {slide for slide, sheets in plan["slide_sheets"].items() if sheets & changed}
+
+    if workers > 1:
+        replacements, pages = render_slide_parts(plan, dfs, cells, timer, workers, slides)
+    else:
+        touched, pages = render_slides(prs, plan, dfs, cells, timer, slides)
+        replacements = _slide_blobs(prs, touched)
+
+    with timer.stage("save"):
+        output = io.BytesIO()
+        base, stale = plan["blob"], []
+        if previous is not None:
+            # A rebuilt slide's old continuation slides make way for its new ones
+            base = previous[0]
+            continuations = previous[1]["continuations"]
+            stale = [record for slide in sorted(slides) for record in continuations.get(plan["slide_parts"][slide], ())]
+        write_package(base, {**replacements, **continuation_parts(base, pages, stale)}, output)
+        output.seek(0)
+        _save_report(report_id, plan, output.getvalue(), hashes)
+
+    rebuilt = dependent if slides is None else slides
+    return output, {"rebuilt": sorted(rebuilt), "reused": sorted(dependent - rebuilt)}
+
+def run_generation(xlsm_path: str, template_path: str, profile: bool = False, report_id: str = None,
+                   workers: int = None):
+    # build_presentation (or build_incremental, given a report id) plus its
+    # per-stage timings; optionally under cProfile
+    timer = StageTimer()
+    start = time.perf_counter()
+    profiler = cProfile.Profile() if profile or PROFILE_MODE == "all" else None
+    try:
+        if profiler:
+            profiler.enable()
+        if report_id:
+            output, slides = build_incremental(xlsm_path, template_path, report_id, timer, workers)
+        else:
+            output, slides = build_presentation(xlsm_path, template_path, timer, workers), None
+    finally:
+        if profiler:
+            profiler.disable()
+            os.makedirs(PROFILES_DIR, exist_ok=True)
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            profiler.dump_stats(os.path.join(PROFILES_DIR, f"{stamp}-{os.getpid()}.pstats"))
+    stats = {"seconds": round(time.perf_counter() - start, 4), "stages": timer.stages}
+    if slides is not None:
+        stats["slides"] = slides
+    return output, stats
+
+def record_generation(stats: dict, ok: bool, source: str, **fields):
+    # Stage histograms, counters and one structured log line per generation
+    inc_metric("tt_generations_total", source=source, outcome="ok" if ok else "error")
+    if not ok:
+        inc_metric("tt_generation_failures_total", source=source)
+    stats = stats or {}
+    if "seconds" in stats:
+        observe_metric("tt_generation_seconds", stats["seconds"], source=source)
+    for stage, timing in stats.get("stages", {}).items():
+        observe_metric("tt_stage_seconds", timing["seconds"], stage=stage)
+    record = {"event": "generation", "source": source, "ok": ok, **stats, **fields}
+    app.logger.log(logging.INFO if ok else logging.WARNING, json.dumps(record, default=str))
+    flush_metrics()
+
+# Result cache
+# Two tiers: an in-process LRU of deck bytes, and a directory of .pptx files
+# shared by every worker on the dyno that survives restarts. Both evict
+# least-recently-used entries once over their size cap.
+_result_memory = OrderedDict()
+_result_memory_bytes = 0
+_result_lock = threading.Lock()
+
+def result_cache_key(xlsm_path: str, template_path: str) -> str:
+    template_sha = get_render_plan(template_path)["sha256"]
+    raw = f"{_file_sha256(xlsm_path)}:{template_sha}:{CODE_VERSION}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def _remember_result(key: str, data: bytes):
+    global _result_memory_bytes
+    cap = RESULT_CACHE_MEMORY_MB * 1024 * 1024
+    if len(data) > cap:
+        return
+    with _result_lock:
+        if key in _result_memory:
+            _result_memory_bytes -= len(_result_memory.pop(key))
+        _result_memory[key] = data
+        _result_memory_bytes += len(data)
+        while _result_memory_bytes > cap:
+            _, evicted = _result_memory.popitem(last=False)
+            _result_memory_bytes -= len(evicted)
+        set_metric("tt_result_cache_bytes", _result_memory_bytes, tier="memory")
+
+def get_cached_result(key: str):
+    with _result_lock:
+        data = _result_memory.get(key)
+        if data is not None:
+            _result_memory.move_to_end(key)
+    if data is not None:
+        inc_metric("tt_result_cache_hits_total", tier="memory")
+        return data
+
+    path = os.path.join(RESULTS_DIR, f"{key}.pptx")
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+        os.utime(path)  # mtime doubles as the disk tier's LRU clock
+    except OSError:
+        inc_metric("tt_result_cache_misses_total")
+        return None
+    inc_metric("tt_result_cache_hits_total", tier="disk")
+    _remember_result(key, data)
+    return data
+
+def _evict_disk_results():
+    entries = []
+    for entry in os.scandir(RESULTS_DIR):
+        if entry.name.endswith(".pptx"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= RESULT_CACHE_DISK_MB * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+def _disk_results_bytes() -> int:
+    total = 0
+    for entry in os.scandir(RESULTS_DIR) if os.path.isdir(RESULTS_DIR) else []:
+        try:
+            total += entry.stat().st_size if entry.name.endswith(".pptx") else 0
+        except OSError:
+            continue  # evicted while we looked
+    return total
+
+def put_cached_result(key: str, data: bytes, memory: bool = True):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{key}.pptx")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp_path, path)
+    _evict_disk_results()
+    if memory:
+        _remember_result(key, data)
+
+# Background jobs
+# Job state lives in SQLite and results on disk so any gunicorn worker can
+# answer a poll; rendering happens in a per-worker process pool.
+_executor = None
+_executor_lock = threading.Lock()
+
+def _jobs_db() -> sqlite3.Connection:
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    db = sqlite3.connect(os.path.join(JOBS_DIR, "jobs.sqlite3"), timeout=30, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        " id TEXT PRIMARY KEY, status TEXT NOT NULL, error TEXT,"
+        " created REAL NOT NULL, finished REAL, deadline REAL)"
+    )
+    if "deadline" not in {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}:
+        try:  # a jobs table from before per-job deadlines
+            db.execute("ALTER TABLE jobs ADD COLUMN deadline REAL")
+        except sqlite3.OperationalError:
+            pass  # another worker just added it
+    return db
+
+def _job_deadline(job: dict) -> float:
+    # Rows without one predate batch jobs, which are the only ones that differ
+    return job["deadline"] or job["created"] + JOB_TIMEOUT_SECONDS
+
+def _set_job_status(job_id: str, status: str, error: str = None):
+    finished = time.time() if status in ("done", "failed") else None
+    with closing(_jobs_db()) as db:
+        db.execute(
+            "UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?",
+            (status, error, finished, job_id),
+        )
+
+def _get_job(job_id: str):
+    # A poll also times out the job itself once it is past its deadline
+    # (its worker restarted, so nothing will finish it);
+    # otherwise only the next submit's _expire_jobs would notice
+    with closing(_jobs_db()) as db:
+        row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row and row["status"] in ("queued", "running") and _job_deadline(row) < time.time():
+            _set_job_status(job_id, "failed", "Timed out")
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+def _expire_jobs():
+    # Jobs orphaned by a restarted worker stop counting against the queue once
+    # past their deadline, and finished results are removed once nobody can be
+    # polling for them.
+    now = time.time()
+    with closing(_jobs_db()) as db:
+        db.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Timed out', finished = ?"
+            " WHERE status IN ('queued', 'running') AND COALESCE(deadline, created + ?) < ?",
+            (now, JOB_TIMEOUT_SECONDS, now),
+        )
+        expired = [row["id"] for row in db.execute(
+            "SELECT id FROM jobs WHERE finished IS NOT NULL AND finished < ?", (now - JOB_TTL_SECONDS,)
+        )]
+        db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+    for job_id in expired:
+        shutil.rmtree(os.path.join(JOBS_DIR, job_id), ignore_errors=True)
+
+def _job_executor(reset: bool = False) -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None or reset:
+            _executor = ProcessPoolExecutor(max_workers=JOB_WORKERS)
+        return _executor
+
+def _write_result(result_path: str, data):
+    with open(f"{result_path}.tmp", "wb") as fh:
+        fh.write(data)
+    os.replace(f"{result_path}.tmp", result_path)
+
+def _run_job(job_id: str, xlsm_path: str, template_path: str, result_path: str, cache_key: str,
+             report_id: str = None):
+    # Runs inside a pool process; only the shared disk tier is worth filling here
+    _set_job_status(job_id, "running")
+    output, stats = run_generation(xlsm_path, template_path, report_id=report_id)
+    if "slides" in stats:
+        _write_result(os.path.join(os.path.dirname(result_path), "slides.json"), json.dumps(stats["slides"]).encode())
+    _write_result(result_path, output.getbuffer())
+    put_cached_result(cache_key, output.getvalue(), memory=False)
+    return stats
+
+def _run_batch_job(job_id: str, workbooks: list, template_path: str, result_path: str):
+    # Runs inside a job pool process, so a batch holds one job slot however
+    # many workbooks it has, and fans them out over BATCH_JOB_WORKERS of its
+    # own; the ZIP (manifest last) is only published whole
+    _set_job_status(job_id, "running")
+    with open(f"{result_path}.tmp", "wb") as fh:
+        for chunk in stream_batch_zip(run_batch(workbooks, template_path, workers=BATCH_JOB_WORKERS)):
+            fh.write(chunk)
+    os.replace(f"{result_path}.tmp", result_path)
+
+def _job_finished(job_id: str, input_path: str, future, batch: bool = False):
+    error = future.exception()
+    # A batch job's decks were already recorded one by one as they rendered
+    if not batch:
+        record_generation(None if error else future.result(), error is None, "job", job=job_id,
+                          **({"error": str(error)} if error else {}))
+    if error is None:
+        _set_job_status(job_id, "done")
+    else:
+        app.logger.error("Report job %s failed: %s", job_id, error)
+        _set_job_status(job_id, "failed", str(error) or error.__class__.__name__)
+    if os.path.isdir(input_path):
+        shutil.rmtree(input_path, ignore_errors=True)
+        return
+    try:
+        os.remove(input_path)
+    except OSError:
+        pass
+
+def _enqueue_job(job_id: str, job_dir: str, input_path: str, run, *args, batch: bool = False,
+                 timeout: float = JOB_TIMEOUT_SECONDS) -> bool:
+    # Queue run(*args) on the job pool, or remove the job's directory and
+    # return False when JOB_QUEUE_DEPTH jobs are already queued or running.
+    # The job counts as orphaned once `timeout` seconds have passed.
+    with closing(_jobs_db()) as db:
+        db.execute("BEGIN IMMEDIATE")
+        active = db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+        if active >= JOB_QUEUE_DEPTH:
+            db.execute("ROLLBACK")
+            shutil.rmtree(job_dir, ignore_errors=True)
+            return False
+        now = time.time()
+        db.execute(
+            "INSERT INTO jobs (id, status, created, deadline) VALUES (?, 'queued', ?, ?)", (job_id, now, now + timeout)
+        )
+        db.execute("COMMIT")
+
+    try:
+        future = _job_executor().submit(run, *args)
+    except BrokenProcessPool:
+        future = _job_executor(reset=True).submit(run, *args)
+    future.add_done_callback(partial(_job_finished, job_id, input_path, batch=batch))
+    return True
+
+def submit_job(file, ext: str, template_path: str = PPT_TEMPLATE_PATH, report_id: str = None):
+    # Returns the new job id, or None when the queue is already full. With a
+    # report id the cache is skipped so the report's saved state stays current.
+    # A workbook that fails validation raises SpecError and is never queued.
+    _expire_jobs()
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    xlsm_path = os.path.join(job_dir, f"input{ext}")
+    result_path = os.path.join(job_dir, "result.pptx")
+    file.save(xlsm_path)
+    try:
+        require_valid_worksheet(xlsm_path, get_render_plan(template_path))
+    except SpecError:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+
+    cache_key = result_cache_key(xlsm_path, template_path)
+    cached = None if report_id else get_cached_result(cache_key)
+    if cached is not None:
+        _write_result(result_path, cached)
+        os.remove(xlsm_path)
+        now = time.time()
+        with closing(_jobs_db()) as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, created, finished) VALUES (?, 'done', ?, ?)", (job_id, now, now)
+            )
+        return job_id
+
+    if not _enqueue_job(job_id, job_dir, xlsm_path,
+                        _run_job, job_id, xlsm_path, template_path, result_path, cache_key, report_id):
+        return None
+    return job_id
+
+def submit_batch_job(upload, template_path: str):
+    # Like submit_job, for a ZIP of worksheets; the result is a ZIP of decks
+    # plus manifest.json. Raises ValueError/BadZipFile for an unusable upload.
+    _expire_jobs()
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(JOBS_DIR, job_id)
+    inputs_dir = os.path.join(job_dir, "inputs")
+    os.makedirs(inputs_dir, exist_ok=True)
+    try:
+        workbooks = _extract_batch_upload(upload, inputs_dir)
+        if not workbooks:
+            raise ValueError("No .xlsm/.xlsx worksheets found in the ZIP.")
+    except (zipfile.BadZipFile, ValueError):
+        shutil.rmtree(job_dir, ignore_errors=True)
+        raise
+    result_path = os.path.join(job_dir, "result.zip")
+    rounds = -(-len(workbooks) // BATCH_JOB_WORKERS)
+    if not _enqueue_job(job_id, job_dir, inputs_dir,
+                        _run_batch_job, job_id, workbooks, template_path, result_path, batch=True,
+                        timeout=JOB_TIMEOUT_SECONDS + BATCH_SECONDS_PER_FILE * rounds):
+        return None
+    return job_id
+
+def _job_json(job: dict) -> dict:
+    body = {"id": job["id"], "status": job["status"], "error": job["error"]}
+    body["status_url"] = url_for("job_status", job_id=job["id"])
+    if job["status"] == "done":
+        body["result_url"] = url_for("job_result", job_id=job["id"])
+    return body
+
+# Batch generation
+class _ZipStream(io.RawIOBase):
+    # Write-only sink for zipfile; drain() hands back what was written so far
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _init_batch_worker(template_path: str):
+    # Compile the template once per pool process, not once per workbook
+    get_render_plan(template_path)
+
+def _render_batch_item(name: str, xlsm_path: str, template_path: str, use_cache: bool) -> dict:
+    # Runs inside a pool process. Errors are returned, never raised, so one
+    # bad workbook can't take the batch down with it.
+    start, stats = time.perf_counter(), None
+    try:
+        cache_key = result_cache_key(xlsm_path, template_path) if use_cache else None
+        data = get_cached_result(cache_key) if use_cache else None
+        if data is None:
+            # Decks already render in parallel here, one per pool process
+            output, stats = run_generation(xlsm_path, template_path, workers=1)
+            data = output.getvalue()
+            if use_cache:
+                put_cached_result(cache_key, data, memory=False)
+        return {"file": name, "status": "ok", "data": data, "seconds": round(time.perf_counter() - start, 3),
+                "stats": stats}
+    except Exception as e:
+        return {"file": name, "status": "error", "error": str(e) or e.__class__.__name__,
+                "seconds": round(time.perf_counter() - start, 3)}
+
+def _pooled_batch_results(workbooks, template_path: str, workers: int, use_cache: bool):
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_batch_worker, initargs=(template_path,)
+    ) as pool:
+        names = {
+            pool.submit(_render_batch_item, name, path, template_path, use_cache): name
+            for name, path in workbooks
+        }
+        for future in as_completed(names):
+            try:
+                yield future.result()
+            except Exception as e:  # the pool process itself died
+                yield {"file": names[future], "status": "error", "error": str(e) or e.__class__.__name__}
+
+def run_batch(workbooks, template_path: str, workers: int = None, use_cache: bool = True):
+    # Yields one result dict per (name, path) in `workbooks` as each finishes.
+    # With one worker they render in order in this process, without a pool.
+    workers = max(1, min(workers or BATCH_WORKERS, len(workbooks) or 1))
+    if workers == 1:
+        _init_batch_worker(template_path)
+        results = (_render_batch_item(name, path, template_path, use_cache) for name, path in workbooks)
+    else:
+        results = _pooled_batch_results(workbooks, template_path, workers, use_cache)
+    for result in results:
+        # Pool processes can't reach this process's metrics, so record here
+        stats = result.pop("stats", None)
+        if stats or result["status"] != "ok":
+            record_generation(stats, result["status"] == "ok", "batch", file=result["file"],
+                              **({"error": result["error"]} if "error" in result else {}))
+        yield result
+
+def stream_batch_zip(results):
+    # ZIP of <workbook>.pptx plus manifest.json, emitted as decks complete
+    stream = _ZipStream()
+    manifest, used_names = [], set()
+    # Decks are already deflated, so store them as-is
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+        for result in results:
+            data = result.pop("data", None)
+            if data is not None:
+                stem = os.path.splitext(os.path.basename(result["file"]))[0]
+                output_name, n = f"{stem}.pptx", 1
+                while output_name in used_names:
+                    n += 1
+                    output_name = f"{stem}_{n}.pptx"
+                used_names.add(output_name)
+                result["output"] = output_name
+                archive.writestr(output_name, data)
+            manifest.append(result)
+            yield stream.drain()
+        archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+    yield stream.drain()
+
+def collect_workbooks(directory: str) -> list:
+    workbooks = []
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            if os.path.splitext(filename)[1].lower() in ALLOWED_EXCEL_EXTS and not filename.startswith(("~$", ".")):
+                path = os.path.join(root, filename)
+                workbooks.append((os.path.relpath(path, directory), path))
+    return sorted(workbooks)
+
+def _extract_batch_upload(upload, target_dir: str) -> list:
+    # Only worksheets are taken from the ZIP, flattened to safe file names
+    workbooks = []
+    with zipfile.ZipFile(upload) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/"):
+                continue
+            if os.path.splitext(name)[1].lower() not in ALLOWED_EXCEL_EXTS:
+                continue
+            if len(workbooks) >= BATCH_MAX_FILES:
+                raise ValueError(f"Batch is limited to {BATCH_MAX_FILES} worksheets")
+            safe_name = f"{len(workbooks):04d}_{secure_filename(posixpath.basename(name)) or 'worksheet.xlsx'}"
+            path = os.path.join(target_dir, safe_name)
+            with archive.open(info) as src, open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            workbooks.append((name, path))
+    return workbooks
+
+# Warm-up
+def warm_up(template_path: str = PPT_TEMPLATE_PATH, worksheet_path: str = SAMPLE_WORKSHEET_PATH):
+    # Compile the registered templates' plans (as many as the LRU holds), then
+    # render the sample worksheet once so the lazy imports and first-call
+    # setup in pandas/python-pptx/lxml are paid here, not by the first request.
+    for path in list(list_templates().values())[:TEMPLATE_PLAN_CACHE_SIZE]:
+        if path != template_path and os.path.exists(path):
+            try:
+                get_render_plan(path)
+            except Exception as e:
+                app.logger.warning("Template %s failed to compile: %s", path, e)
+    if not os.path.exists(template_path):
+        return
+    get_render_plan(template_path)
+    if os.path.exists(worksheet_path):
+        try:
+            # In order, whatever RENDER_WORKERS says: with --preload this runs
+            # in the master, which must not start a render pool for workers
+            # to inherit
+            build_presentation(worksheet_path, template_path, workers=1)
+        except Exception as e:
+            app.logger.warning("Warm-up render failed: %s", e)
+
+def create_app():
+    # Entry point for `gunicorn --preload "app:create_app()"`: the warm-up
+    # runs in the master, so forked workers share the compiled template plans
+    # and the imported modules copy-on-write; freezing the GC keeps
+    # collections in the workers from touching (and so copying) those pages.
+    # Without --preload each worker warms itself up here. Importing the
+    # module (CLI, bench.py) never warms up.
+    if WARM_UP:
+        warm_up()
+    gc.freeze()
+    return app
+
 # Routers
 @app.route("/")
 def index():
     if not os.path.exists(PPT_TEMPLATE_PATH):
         flash("Template not found: put TT_report.pptx beside app.py")
-    return render_template_string(HTML, template_name=os.path.basename(PPT_TEMPLATE_PATH))
+    return render_template_string(
+        HTML, template_name=os.path.basename(PPT_TEMPLATE_PATH), templates=list(list_templates())
+    )
 
 @app.route("/download-template")
 def download_template():
     return send_file(
-        "TT_worksheet.xlsm",
+        SAMPLE_WORKSHEET_PATH,
         as_attachment=True,
         download_name="TT_worksheet.xlsm",
         mimetype="application/vnd.ms-excel.sheet.macroEnabled.12"
@@ -460,25 +2441,224 @@ def generate():
         flash("Unsupported file type. Upload .xlsm or .xlsx.")
         return redirect(url_for("index"))
 
+    template_name = request.form.get("template") or DEFAULT_TEMPLATE
+    template_path = list_templates().get(template_name)
+    if template_path is None:
+        flash(f"Unknown template: {template_name}")
+        return redirect(url_for("index"))
+
+    report_id = request.form.get("report_id") or None
+    if report_id is not None and not valid_report_id(report_id):
+        flash("Report id may only use letters, digits, '.', '_' and '-' (up to 64).")
+        return redirect(url_for("index"))
+
+    if request.form.get("mode") == "async":
+        try:
+            job_id = submit_job(file, ext, template_path, report_id)
+        except SpecError as e:
+            return _problems_response(e)
+        if job_id is None:
+            response = jsonify(error="The report queue is full. Please try again shortly.")
+            response.status_code = 429
+            response.headers["Retry-After"] = "30"
+            return response
+        return jsonify(_job_json(_get_job(job_id))), 202
+
     with tempfile.TemporaryDirectory() as tmpdir:
         safe_name = secure_filename(file.filename)
         xlsm_path = os.path.join(tmpdir, safe_name)
         file.save(xlsm_path)
 
+        # A profiled run always renders, so the dump reflects real work; an
+        # incremental one too, so the report's saved state stays current
+        profile = PROFILE_MODE == "request" and request.args.get("profile") == "1"
+        stats = None
         try:
-            output = build_presentation(xlsm_path, PPT_TEMPLATE_PATH)
+            cache_key = result_cache_key(xlsm_path, template_path)
+            cached = None if profile or report_id else get_cached_result(cache_key)
+            if cached is not None:
+                output = io.BytesIO(cached)
+            else:
+                output, stats = run_generation(xlsm_path, template_path, profile=profile, report_id=report_id)
+                put_cached_result(cache_key, output.getvalue())
+                record_generation(stats, True, "sync", file=safe_name, template=template_name)
         except Exception as e:
+            record_generation(stats, False, "sync", file=safe_name, template=template_name, error=str(e))
+            if isinstance(e, SpecError) and request.accept_mimetypes.best_match(
+                ["text/html", "application/json"]
+            ) == "application/json":
+                return _problems_response(e)
             flash(f"Error generating PPT: {e}")
             return redirect(url_for("index"))
 
     ts = datetime.now().strftime("%Y-%m-%d_%H-%M")
-    return send_file(
+    response = send_file(
         output,
         as_attachment=True,
         download_name=f"TT_report_{ts}.pptx",
-        mimetype="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+        mimetype=PPTX_MIMETYPE,
+    )
+    if stats and "slides" in stats:
+        _set_slide_headers(response, stats["slides"])
+    return response
+
+def _problems_response(error: SpecError):
+    # 422 with every validation problem, e.g. {"code": "not_a_number",
+    # "key": "VL10", "sheet": "LeasingInfographic", "cell": "A2", "message": ...}
+    response = jsonify(ok=False, error=f"{error.summary}.", problems=error.problems)
+    response.status_code = 422
+    return response
+
+@app.route("/validate", methods=["POST"])
+def validate():
+    # The generation pre-pass on its own, so the page can check a workbook
+    # before submitting it: 200 {"ok": true, "problems": []} or a 422
+    file = request.files.get("xlsm")
+    if not file or file.filename == "":
+        return jsonify(error="Upload an .xlsm or .xlsx file as 'xlsm'."), 400
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in ALLOWED_EXCEL_EXTS:
+        return jsonify(error="Unsupported file type. Upload .xlsm or .xlsx."), 400
+    template_name = request.form.get("template") or DEFAULT_TEMPLATE
+    template_path = list_templates().get(template_name)
+    if template_path is None:
+        return jsonify(error=f"Unknown template: {template_name}"), 400
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        xlsm_path = os.path.join(tmpdir, f"input{ext}")
+        file.save(xlsm_path)
+        try:
+            problems = validate_worksheet(xlsm_path, get_render_plan(template_path))
+        except SpecError as e:
+            return _problems_response(e)
+    inc_metric("tt_validations_total", outcome="rejected" if problems else "ok")
+    if problems:
+        return _problems_response(SpecError(problems))
+    return jsonify(ok=True, problems=[])
+
+def _set_slide_headers(response, slides: dict):
+    # Slide indexes (as in SLIDE_TABLES) an incremental run rebuilt or reused
+    response.headers["X-Slides-Rebuilt"] = ",".join(map(str, slides["rebuilt"]))
+    response.headers["X-Slides-Reused"] = ",".join(map(str, slides["reused"]))
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    return jsonify(_job_json(job))
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    if job["status"] != "done":
+        return jsonify(_job_json(job)), 409 if job["status"] == "failed" else 202
+
+    ts = datetime.fromtimestamp(job["finished"]).strftime("%Y-%m-%d_%H-%M")
+    zip_path = os.path.join(JOBS_DIR, job["id"], "result.zip")
+    if os.path.exists(zip_path):
+        return send_file(zip_path, as_attachment=True, download_name=f"TT_reports_{ts}.zip",
+                         mimetype="application/zip")
+    response = send_file(
+        os.path.join(JOBS_DIR, job["id"], "result.pptx"),
+        as_attachment=True,
+        download_name=f"TT_report_{ts}.pptx",
+        mimetype=PPTX_MIMETYPE,
     )
+    slides_path = os.path.join(JOBS_DIR, job["id"], "slides.json")
+    if os.path.exists(slides_path):
+        with open(slides_path) as fh:
+            _set_slide_headers(response, json.load(fh))
+    return response
+
+@app.route("/batch", methods=["POST"])
+def batch():
+    # Queues the batch as one background job (poll /jobs/<id>, then fetch the
+    # ZIP from its result_url); long runs belong on `python app.py batch`
+    upload = request.files.get("zip")
+    if not upload or not upload.filename.lower().endswith(".zip"):
+        return jsonify(error="Upload a .zip of .xlsm/.xlsx worksheets as 'zip'."), 400
+    template_name = request.form.get("template") or DEFAULT_TEMPLATE
+    template_path = list_templates().get(template_name)
+    if template_path is None:
+        return jsonify(error=f"Unknown template: {template_name}"), 400
+
+    try:
+        job_id = submit_batch_job(upload, template_path)
+    except (zipfile.BadZipFile, ValueError) as e:
+        return jsonify(error=str(e)), 400
+    if job_id is None:
+        response = jsonify(error="The report queue is full. Please try again shortly.")
+        response.status_code = 429
+        response.headers["Retry-After"] = "30"
+        return response
+    return jsonify(_job_json(_get_job(job_id))), 202
+
+@app.route("/templates")
+def templates():
+    return jsonify(templates=list(list_templates()), default=DEFAULT_TEMPLATE)
+
+@app.after_request
+def count_request(response):
+    inc_metric("tt_http_requests_total", endpoint=request.endpoint or "unknown", status=response.status_code)
+    flush_metrics()
+    return response
+
+@app.route("/metrics")
+def metrics():
+    # Counters and histograms are summed over every process on the dyno; the
+    # queue gauges come from the shared jobs table and the disk cache size
+    # from its directory, so they aren't per process
+    with closing(_jobs_db()) as db:
+        counts = dict(db.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY status"
+        ).fetchall())
+    gauges = {("tt_jobs", (("status", status),)): counts.get(status, 0) for status in ("queued", "running")}
+    gauges[("tt_job_queue_limit", ())] = JOB_QUEUE_DEPTH
+    gauges[("tt_job_queue_saturation", ())] = sum(counts.values()) / JOB_QUEUE_DEPTH
+    gauges[("tt_job_workers", ())] = JOB_WORKERS
+    gauges[("tt_result_cache_bytes", (("tier", "disk"),))] = _disk_results_bytes()
+    return render_metrics(gauges), 200, {"Content-Type": "text/plain; version=0.0.4"}
 
 # --------------- Run locally ---------------
+def batch_cli(argv):
+    parser = argparse.ArgumentParser(prog="app.py batch", description="Generate a deck for every worksheet in a directory.")
+    parser.add_argument("directory")
+    parser.add_argument("-o", "--output", default="TT_reports.zip")
+    parser.add_argument("-w", "--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="registered template name or a .pptx path")
+    parser.add_argument("--no-cache", action="store_true", help="always re-render, ignoring the result cache")
+    args = parser.parse_args(argv)
+
+    workbooks = collect_workbooks(args.directory)
+    if not workbooks:
+        parser.error(f"no .xlsm/.xlsx files under {args.directory}")
+    template_path = list_templates().get(args.template, args.template)
+
+    failures, start = [], time.perf_counter()
+
+    def report(results):
+        for n, result in enumerate(results, 1):
+            if result["status"] != "ok":
+                failures.append(result)
+            print(f"[{n}/{len(workbooks)}] {result['status']:<5} {result['file']}", file=sys.stderr)
+            yield result
+
+    with open(args.output, "wb") as fh:
+        for chunk in stream_batch_zip(report(run_batch(workbooks, template_path, args.workers, not args.no_cache))):
+            fh.write(chunk)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(workbooks) - len(failures)} ok, {len(failures)} failed in {elapsed:.1f}s "
+        f"({len(workbooks) / elapsed * 60:.1f} decks/min) -> {args.output}",
+        file=sys.stderr,
+    )
+    return 1 if failures else 0
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    if sys.argv[1:2] == ["batch"]:
+        sys.exit(batch_cli(sys.argv[2:]))
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
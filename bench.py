@@ -0,0 +1,775 @@
+"""Benchmarks for the report pipeline in app.py.
+
+Run from the repo root, e.g.:
+
+    python bench.py substitution --template TT_report.pptx --worksheet TT_worksheet.xlsm
+    python bench.py suite --output results.json --compare previous.json
+    python bench.py tables --rows 1000 10000
+"""
+import argparse
+import copy
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+# `coldstart` reports how long the heavy imports below take
+_IMPORT_START = time.perf_counter()
+import numpy as np
+import openpyxl
+import pandas as pd
+from lxml import etree
+from pptx import Presentation
+from pptx.dml.color import RGBColor
+from pptx.util import Inches, Pt
+
+import app
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TEMPLATE = app.PPT_TEMPLATE_PATH
+DEFAULT_WORKSHEET = os.path.join(HERE, "TT_worksheet.xlsm")
+
+
+def _timeit(fn, repeat, setup=None):
+    # Returns per-run wall times; `setup` runs untimed before every call.
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _report(label, times):
+    print(f"{label:<28} best {min(times) * 1000:8.2f} ms   median {statistics.median(times) * 1000:8.2f} ms")
+
+
+def _load_mapping(worksheet):
+    return app.build_variable_mapping(*app.load_worksheet(worksheet))
+
+
+# ---------------- Placeholder substitution ----------------
+def _legacy_substitute(prs, variable_mapping):
+    # The original nested loop: every run/cell x every key, str.replace per key.
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if hasattr(shape, "text_frame") and shape.text_frame:
+                for paragraph in shape.text_frame.paragraphs:
+                    for run in paragraph.runs:
+                        for key, value in variable_mapping.items():
+                            if key in run.text:
+                                run.text = run.text.replace(key, str(value))
+            if getattr(shape, "has_table", False):
+                for row in shape.table.rows:
+                    for cell in row.cells:
+                        for key, value in variable_mapping.items():
+                            if key in cell.text:
+                                cell.text = cell.text.replace(key, str(value))
+
+
+def _compiled_substitute(prs, variable_mapping):
+    substitutions = {key: str(value) for key, value in variable_mapping.items()}
+    pattern = app.compile_placeholders(substitutions)
+    replace = lambda match: substitutions[match.group(0)]
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if hasattr(shape, "text_frame") and shape.text_frame:
+                for paragraph in shape.text_frame.paragraphs:
+                    for run in paragraph.runs:
+                        text, count = pattern.subn(replace, run.text)
+                        if count:
+                            run.text = text
+            if getattr(shape, "has_table", False):
+                for row in shape.table.rows:
+                    for cell in row.cells:
+                        text, count = pattern.subn(replace, cell.text)
+                        if count:
+                            cell.text = text
+
+
+def bench_substitution(args):
+    variable_mapping = _load_mapping(args.worksheet)
+    setup = lambda: Presentation(args.template)
+    legacy = _timeit(lambda prs: _legacy_substitute(prs, variable_mapping), args.repeat, setup)
+    compiled = _timeit(lambda prs: _compiled_substitute(prs, variable_mapping), args.repeat, setup)
+    print(f"{len(variable_mapping)} placeholder keys, template {os.path.basename(args.template)}")
+    _report("nested loop (str.replace)", legacy)
+    _report("compiled regex", compiled)
+    print(f"speedup: {min(legacy) / min(compiled):.1f}x")
+
+
+# ---------------- Worksheet loading ----------------
+LEGACY_SHEETS = [
+    "LeasingInfographic", "CompetitiveMarketPosition", "ZipCodes",
+    "DrawDemo", "DistanceTravelled", "Frequency", "Duration", "MileageDemo",
+]
+
+LOADERS = {
+    "pd.read_excel (8 sheets)": lambda path: pd.read_excel(path, sheet_name=LEGACY_SHEETS, engine="openpyxl"),
+    "load_worksheet": app.load_worksheet,
+}
+
+
+def _maxrss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure_loader(label, worksheet):
+    # Runs in a fresh interpreter so peak RSS belongs to this loader alone
+    rss_before = _maxrss_mb()
+    start, cpu_start = time.perf_counter(), time.process_time()
+    LOADERS[label](worksheet)
+    return {
+        "wall_s": time.perf_counter() - start,
+        "cpu_s": time.process_time() - cpu_start,
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": _maxrss_mb(),
+    }
+
+
+def bench_loader(args):
+    print(f"worksheet {os.path.basename(args.worksheet)} ({os.path.getsize(args.worksheet) / 1024:.0f} KiB)")
+    for label in LOADERS:
+        runs = []
+        for _ in range(args.repeat):
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worksheet", args.worksheet, "_measure-loader", label],
+                check=True, capture_output=True, text=True, cwd=HERE, env={**os.environ, "TT_WARM_UP": "0"},
+            )
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        _report(label, [run["wall_s"] for run in runs])
+        peak = max(run["peak_rss_mb"] for run in runs)
+        growth = max(run["peak_rss_mb"] - run["rss_before_mb"] for run in runs)
+        print(f"{'':<28} peak RSS {peak:8.1f} MB   (+{growth:.1f} MB while loading)")
+
+
+# ---------------- Batch throughput ----------------
+def bench_batch(args):
+    # Distinct copies of the worksheet; the result cache is bypassed anyway
+    workers = args.workers or sorted({1, 2, 4, os.cpu_count() or 1})
+    tmpdir = tempfile.mkdtemp()
+    try:
+        workbooks = []
+        for n in range(args.decks):
+            path = os.path.join(tmpdir, f"market_{n:03d}.xlsm")
+            shutil.copyfile(args.worksheet, path)
+            workbooks.append((os.path.basename(path), path))
+
+        print(f"{args.decks} decks, template {os.path.basename(args.template)}")
+        for count in workers:
+            start = time.perf_counter()
+            results = list(app.run_batch(workbooks, args.template, workers=count, use_cache=False))
+            elapsed = time.perf_counter() - start
+            failed = sum(result["status"] != "ok" for result in results)
+            print(f"{count:>3} workers   {elapsed:7.2f} s   {args.decks / elapsed * 60:7.1f} decks/min"
+                  + (f"   ({failed} failed)" if failed else ""))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# ---------------- Run styling ----------------
+def _table_cells(prs):
+    # Every data cell of the SLIDE_TABLES tables in a freshly loaded template
+    cells = []
+    for entry in app.SLIDE_TABLES:
+        slide = prs.slides[entry["slide"]]
+        table = next((s.table for s in slide.shapes if getattr(s, "has_table", False)), None)
+        if table is not None:
+            cells.extend(table.cell(r, c) for r in range(1, len(table.rows)) for c in range(len(table.columns)))
+    return cells
+
+
+def _legacy_style(cells):
+    for n, cell in enumerate(cells):
+        cell.text = f"{n:,}"
+        for paragraph in cell.text_frame.paragraphs:
+            for run in paragraph.runs:
+                run.font.name = "Roboto"
+                run.font.size = Pt(9)
+                run.font.color.rgb = RGBColor(0, 0, 0)
+
+
+def _cloned_style(cells):
+    for n, cell in enumerate(cells):
+        app.set_cell_text(cell, f"{n:,}", "body")
+
+
+def bench_styling(args):
+    setup = lambda: _table_cells(Presentation(args.template))
+    count = len(setup())
+    legacy = _timeit(_legacy_style, args.repeat, setup)
+    cloned = _timeit(_cloned_style, args.repeat, setup)
+    print(f"{count} table cells filled, template {os.path.basename(args.template)}")
+    _report("font.* per run", legacy)
+    _report("cloned rPr fragment", cloned)
+    print(f"speedup: {min(legacy) / min(cloned):.1f}x")
+
+
+# ---------------- Output regression ----------------
+def _c14n(xml):
+    return etree.tostring(etree.fromstring(xml), method="c14n")
+
+
+def compare_decks(expected, actual, canonical=False):
+    # Slide parts that differ between two .pptx files (paths or file objects).
+    # `canonical` ignores serialization details such as the XML declaration.
+    same = (lambda x, y: x == y or _c14n(x) == _c14n(y)) if canonical else (lambda x, y: x == y)
+    with zipfile.ZipFile(expected) as a, zipfile.ZipFile(actual) as b:
+        slides_a = sorted(n for n in a.namelist() if n.startswith("ppt/slides/slide"))
+        slides_b = sorted(n for n in b.namelist() if n.startswith("ppt/slides/slide"))
+        if slides_a != slides_b:
+            return sorted(set(slides_a) ^ set(slides_b))
+        return [name for name in slides_a if not same(a.read(name), b.read(name))]
+
+
+def _legacy_sheet_lookup(tabs, slide_data):
+    # How build_presentation used to recover each table's sheet name: the
+    # slide's DataFrame compared against all eight tabs pd.read_excel loaded
+    return {
+        slide: [name for name, df in tabs.items() if df.equals(df_data)][0]
+        for slide, df_data in slide_data.items()
+    }
+
+
+def _legacy_slide_tables(plan, tabs):
+    # The registry rebuilt the old way: slide -> DataFrame, sheet recovered
+    # by the equals scan, rules and header flags looked up by that sheet name
+    by_sheet = {entry["sheet"]: entry for entry in plan["slide_tables"]}
+    slide_data = {entry["slide"]: tabs[entry["sheet"]] for entry in plan["slide_tables"]}
+    return [{**by_sheet[sheet], "slide": slide} for slide, sheet in _legacy_sheet_lookup(tabs, slide_data).items()]
+
+
+def _render_with_tables(plan, slide_tables, dfs, cells):
+    plan = {**plan, "slide_tables": slide_tables}
+    prs = copy.deepcopy(plan["package"])
+    touched, pages = app.render_slides(prs, plan, dfs, cells, app.StageTimer())
+    output = io.BytesIO()
+    app.save_presentation(prs, plan, touched, output, pages)
+    output.seek(0)
+    return output
+
+
+def bench_regression(args):
+    # Self-contained: the sample deck through the registry (build_presentation)
+    # must match the one rendered with the old equals-scan lookup, part for part
+    plan = app.get_render_plan(args.template)
+    tabs = pd.read_excel(args.worksheet, sheet_name=LEGACY_SHEETS, engine="openpyxl")
+    dfs, cells = app.load_worksheet(args.worksheet, plan["ranges"], plan["table_sheets"])
+    output = app.build_presentation(args.worksheet, args.template, workers=1)
+    legacy = _render_with_tables(plan, _legacy_slide_tables(plan, tabs), dfs, cells)
+    differing = compare_decks(legacy, output)
+    print("registry vs DataFrame.equals lookup: "
+          + ("identical" if not differing else f"{len(differing)} slide parts differ: {differing[:5]}"))
+    status = 1 if differing else 0
+
+    if args.baseline:
+        output.seek(0)
+        differing = compare_decks(args.baseline, output)
+        print(f"output vs {os.path.basename(args.baseline)}: "
+              + ("identical" if not differing else f"{len(differing)} slide parts differ: {differing[:5]}"))
+        status = status or (1 if differing else 0)
+
+    slide_data = {entry["slide"]: tabs[entry["sheet"]] for entry in plan["slide_tables"]}
+    for label, lookup in (
+        ("DataFrame.equals scan", lambda: _legacy_sheet_lookup(tabs, slide_data)),
+        ("SLIDE_TABLES registry", lambda: {entry["slide"]: entry["sheet"] for entry in plan["slide_tables"]}),
+    ):
+        cpu = []
+        for _ in range(args.repeat):
+            start = time.process_time()
+            lookup()
+            cpu.append(time.process_time() - start)
+        print(f"{label:<28} cpu {min(cpu) * 1000:8.3f} ms per report")
+    return status
+
+
+# ---------------- Suite: synthetic worksheets ----------------
+def _first_blank_row(ws):
+    for row in ws.iter_rows(min_row=2):
+        if all(cell.value in (None, "") for cell in row):
+            return row[0].row
+    return ws.max_row + 1
+
+
+def make_scaled_worksheet(worksheet, scale, path):
+    # Repeats the data rows of every SLIDE_TABLES sheet `scale` times inside
+    # its table: generation stops at a tab's first blank row, so the copies go
+    # in just above it. Cell sheets are left alone, so the placeholder spec
+    # still resolves. Returns each tab's non-blank rows, header aside.
+    keep_vba = worksheet.lower().endswith(".xlsm")
+    wb = openpyxl.load_workbook(worksheet, data_only=True, keep_vba=keep_vba)
+    for sheet in app.TABLE_SHEETS:
+        ws = wb[sheet]
+        end = _first_blank_row(ws)
+        rows = [[cell.value for cell in row] for row in ws.iter_rows(min_row=2, max_row=end - 1)]
+        if scale > 1 and rows:
+            ws.insert_rows(end, len(rows) * (scale - 1))
+            for offset, values in enumerate(rows * (scale - 1)):
+                for col, value in enumerate(values, 1):
+                    ws.cell(row=end + offset, column=col, value=value)
+    wb.save(path)
+    return {
+        sheet: sum(1 for row in wb[sheet].iter_rows(min_row=2, values_only=True)
+                   if any(value not in (None, "") for value in row))
+        for sheet in app.TABLE_SHEETS
+    }
+
+
+def _measure_generation(worksheet, template, repeat):
+    # Runs in a fresh interpreter so peak RSS belongs to this scale alone.
+    # One untimed warm-up run builds the template index first.
+    app.run_generation(worksheet, template)
+    runs = []
+    for _ in range(repeat):
+        start, cpu_start = time.perf_counter(), time.process_time()
+        _, stats = app.run_generation(worksheet, template)
+        runs.append({
+            "wall_s": time.perf_counter() - start,
+            "cpu_s": time.process_time() - cpu_start,
+            "stages": {name: timing["seconds"] for name, timing in stats["stages"].items()},
+        })
+    return {"runs": runs, "peak_rss_mb": _maxrss_mb()}
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=HERE)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def find_regressions(baseline, current, threshold):
+    # Metrics that got more than `threshold` (a fraction) worse than baseline
+    regressions = []
+    for scale, result in current["scales"].items():
+        before = baseline.get("scales", {}).get(scale)
+        if not before:
+            continue
+        for metric in ("wall_s", "cpu_s", "peak_rss_mb"):
+            old, new = before.get(metric), result[metric]
+            if old and new > old * (1 + threshold):
+                regressions.append(f"{scale} {metric}: {old:.3f} -> {new:.3f} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def bench_suite(args):
+    median = statistics.median
+    results = {
+        "commit": _git_commit(),
+        "code_version": app.CODE_VERSION,
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "template": os.path.basename(args.template),
+        "worksheet": os.path.basename(args.worksheet),
+        "repeat": args.repeat,
+        "scales": {},
+    }
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for scale in args.scales:
+            path = os.path.join(tmpdir, f"worksheet_{scale}x{os.path.splitext(args.worksheet)[1]}")
+            rows = make_scaled_worksheet(args.worksheet, scale, path)
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worksheet", path, "--template", args.template,
+                 "--repeat", str(args.repeat), "_measure-generation"],
+                check=True, capture_output=True, text=True, cwd=HERE, env={**os.environ, "TT_WARM_UP": "0"},
+            )
+            measured = json.loads(out.stdout.strip().splitlines()[-1])
+            runs = measured["runs"]
+            results["scales"][f"{scale}x"] = {
+                "table_rows": sum(rows.values()),
+                "worksheet_kib": round(os.path.getsize(path) / 1024, 1),
+                "wall_s": median(run["wall_s"] for run in runs),
+                "cpu_s": median(run["cpu_s"] for run in runs),
+                "peak_rss_mb": measured["peak_rss_mb"],
+                "stages": {name: median(run["stages"][name] for run in runs) for name in runs[0]["stages"]},
+            }
+            _report(f"{scale}x ({sum(rows.values())} table rows)", [run["wall_s"] for run in runs])
+            stages = results["scales"][f"{scale}x"]["stages"]
+            print(f"{'':<28} peak RSS {measured['peak_rss_mb']:8.1f} MB   "
+                  + "  ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in stages.items()) + " (ms)")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    with open(args.output, "w") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            regressions = find_regressions(json.load(fh), results, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.threshold:.0%} vs {os.path.basename(args.compare)}")
+    return 0
+
+
+# ---------------- Parallel slide rendering ----------------
+def _check_render_workers(worksheet, template):
+    # Runs in a fresh interpreter with RENDER_WORKERS=2: import, warm up and
+    # create the app as gunicorn --preload does, render with the pool, then
+    # render again in a forked child, which has to start a pool of its own
+    app.warm_up(template, worksheet)
+    app.create_app()
+    expected = app.build_presentation(worksheet, template).getvalue()
+    pid = os.fork()
+    if pid == 0:
+        same = app.build_presentation(worksheet, template).getvalue() == expected
+        app._render_executor(2).shutdown()  # as the worker's exit would
+        os._exit(0 if same else 1)
+    _, status = os.waitpid(pid, 0)
+    return {"render_pools": len(app._render_executors), "forked_worker_ok": status == 0}
+
+
+def bench_render(args):
+    # build_presentation per RENDER_WORKERS setting; output must not change
+    counts = args.workers or sorted({1, 2, 4, os.cpu_count() or 1})
+    expected = app.build_presentation(args.worksheet, args.template, workers=1)
+    print(f"template {os.path.basename(args.template)}, {os.cpu_count()} CPUs")
+    try:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worksheet", args.worksheet, "--template", args.template,
+             "_check-render-workers"],
+            capture_output=True, text=True, cwd=HERE, timeout=120,
+            env={**os.environ, "RENDER_WORKERS": "2", "TT_WARM_UP": "0"},
+        )
+        checked = json.loads(out.stdout.strip().splitlines()[-1]) if out.returncode == 0 else {}
+        ok = checked.get("forked_worker_ok", False)
+        print("import + warm-up + forked worker with RENDER_WORKERS=2: " + ("ok" if ok else f"FAILED\n{out.stderr[-2000:]}"))
+    except subprocess.TimeoutExpired:
+        ok = False
+        print("import + warm-up + forked worker with RENDER_WORKERS=2: HUNG (killed after 120 s)")
+    status = 0 if ok else 1
+    for count in counts:
+        app.build_presentation(args.worksheet, args.template, workers=count)  # start the pool
+        times = _timeit(lambda _: app.build_presentation(args.worksheet, args.template, workers=count), args.repeat)
+        differing = compare_decks(expected, app.build_presentation(args.worksheet, args.template, workers=count))
+        _report(f"{count} render workers", times)
+        if differing:
+            print(f"{'':<28} MISMATCH vs sequential in {differing[:5]}")
+            status = 1
+    return status
+
+
+# ---------------- Worker cold start ----------------
+COLDSTART_MODES = {
+    "lazy": "import in the worker, first request parses the template",
+    "worker": "import + warm_up in each worker (gunicorn without --preload)",
+    "preload": "warm_up in the master, workers forked from it (--preload)",
+}
+
+
+def _memory_mb():
+    # Pss counts shared pages fractionally; private pages are what a worker
+    # really costs on top of its siblings.
+    fields = {}
+    with open("/proc/self/smaps_rollup") as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": fields.get("Rss", 0),
+        "pss_mb": fields.get("Pss", 0),
+        "private_mb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def _first_request(worksheet, template):
+    start = time.perf_counter()
+    app.run_generation(worksheet, template)
+    return time.perf_counter() - start
+
+
+def _measure_coldstart(mode, worksheet, template, workers):
+    # Runs in a fresh interpreter with TT_WARM_UP=0, so nothing is warm yet
+    start = time.perf_counter()
+    if mode == "preload":
+        app.warm_up(template, worksheet)
+        app.create_app()
+        master_s = time.perf_counter() - start
+        results = []
+        for _ in range(workers):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                forked = time.perf_counter()
+                first = _first_request(worksheet, template)
+                report = {"ready_s": 0.0, "first_request_s": first, "cold_start_s": time.perf_counter() - forked}
+                report.update(_memory_mb())
+                os.write(write_fd, json.dumps(report).encode())
+                os._exit(0)
+            os.close(write_fd)
+            with os.fdopen(read_fd) as fh:
+                results.append(json.loads(fh.read()))
+            os.waitpid(pid, 0)
+        return {"import_s": _IMPORT_SECONDS, "master_s": master_s, "workers": results}
+
+    if mode == "worker":
+        app.warm_up(template, worksheet)
+    ready = time.perf_counter() - start
+    first = _first_request(worksheet, template)
+    # Without --preload the worker pays for its own imports too
+    report = {"ready_s": ready, "first_request_s": first,
+              "cold_start_s": _IMPORT_SECONDS + time.perf_counter() - start}
+    report.update(_memory_mb())
+    return {"import_s": _IMPORT_SECONDS, "master_s": 0.0, "workers": [report]}
+
+
+def bench_coldstart(args):
+    print(f"{args.workers} workers, template {os.path.basename(args.template)}")
+    for mode, description in COLDSTART_MODES.items():
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worksheet", args.worksheet, "--template", args.template,
+             "_measure-coldstart", mode, "--workers", str(args.workers)],
+            check=True, capture_output=True, text=True, cwd=HERE, env={**os.environ, "TT_WARM_UP": "0"},
+        )
+        measured = json.loads(out.stdout.strip().splitlines()[-1])
+        worker = max(measured["workers"], key=lambda w: w["cold_start_s"])
+        print(f"{mode:<8} {description}")
+        print(f"{'':<8} import {measured['import_s'] * 1000:6.0f} ms   master {measured['master_s'] * 1000:6.0f} ms   "
+              f"worker cold start {worker['cold_start_s'] * 1000:6.0f} ms "
+              f"(first request {worker['first_request_s'] * 1000:.0f} ms)")
+        print(f"{'':<8} per worker: RSS {worker['rss_mb']:6.1f} MB   PSS {worker['pss_mb']:6.1f} MB   "
+              f"private {worker['private_mb']:6.1f} MB")
+
+
+# ---------------- Package output ----------------
+def _image_heavy_template(template, images, path):
+    # The template plus `images` incompressible 1000x1000 PNGs, one per slide
+    from PIL import Image
+
+    prs = Presentation(template)
+    rng = np.random.default_rng(0)
+    for n in range(images):
+        picture = io.BytesIO()
+        Image.fromarray(rng.integers(0, 255, (1000, 1000, 3), dtype=np.uint8)).save(picture, "PNG")
+        picture.seek(0)
+        prs.slides[n % len(prs.slides)].shapes.add_picture(picture, Inches(8), Inches(5), Inches(1))
+    prs.save(path)
+
+
+def bench_package(args):
+    # Template-zip patching vs prs.save: save-stage timing, plus a check that
+    # the patched deck opens and matches prs.save slide-by-slide
+    tmpdir = tempfile.mkdtemp()
+
+    def full_save(prs, plan, slide_indexes, output, pages=None):
+        if not pages:
+            prs.save(output)
+            return
+        saved = io.BytesIO()
+        prs.save(saved)
+        app.write_package(saved.getvalue(), app.continuation_parts(saved.getvalue(), pages), output)
+
+    patched_save = app.save_presentation
+    try:
+        templates = [args.template]
+        if args.images:
+            templates.append(os.path.join(tmpdir, f"template_{args.images}_images.pptx"))
+            _image_heavy_template(args.template, args.images, templates[-1])
+        status = 0
+        for template in templates:
+            outputs, timings = {}, {}
+            for label, save in (("prs.save", full_save), ("patched template zip", patched_save)):
+                app.save_presentation = save
+                try:
+                    runs = [app.run_generation(args.worksheet, template) for _ in range(args.repeat)]
+                finally:
+                    app.save_presentation = patched_save
+                outputs[label] = runs[-1][0]
+                timings[label] = [stats["stages"]["save"]["seconds"] for _, stats in runs]
+            print(f"template {os.path.basename(template)} ({os.path.getsize(template) / 1024:.0f} KiB)")
+            for label, times in timings.items():
+                _report(f"  save: {label}", times)
+            Presentation(outputs["patched template zip"])
+            differing = compare_decks(outputs["prs.save"], outputs["patched template zip"], canonical=True)
+            print("  slides match prs.save" if not differing else f"  MISMATCH in {differing[:5]}")
+            status = status or (1 if differing else 0)
+        return status
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# ---------------- Table pagination ----------------
+ZIP_SHEET = "ZipCodes"
+
+
+def make_zipcode_worksheet(worksheet, rows, path):
+    # The ZipCodes tab replaced by `rows` synthetic zip-code rows, with no
+    # blank row, so every one of them belongs to the slide table
+    keep_vba = worksheet.lower().endswith(".xlsm")
+    wb = openpyxl.load_workbook(worksheet, data_only=True, keep_vba=keep_vba)
+    ws = wb[ZIP_SHEET]
+    sample = [cell.value for cell in ws[2]]
+    ws.delete_rows(2, ws.max_row)
+    for n in range(rows):
+        ws.append([f"{10000 + n:05d}"] + sample[1:])
+    wb.save(path)
+
+
+def _zipcode_table(plan, dfs, rows):
+    # The ZipCodes slide's table frame, parsed from the template and grown to
+    # `rows` body rows, plus that many formatted rows to fill it with
+    entry = next(entry for entry in plan["slide_tables"] if entry["sheet"] == ZIP_SHEET)
+    slide = app.parse_xml(zipfile.ZipFile(io.BytesIO(plan["blob"])).read(plan["slide_parts"][entry["slide"]]))
+    frame = list(app.SlideShapes(slide.cSld.spTree, None))[plan["tables"][entry["slide"]]]
+    cols = plan["table_sizes"][entry["slide"]][1]
+    body = app.format_table(dfs[ZIP_SHEET], entry["rules"], rows, cols)
+    app.fill_table(frame, {"header": [], "body": body[:, :0], "first_row_header": False})
+    return frame, body
+
+
+def _legacy_table_fill(table, body):
+    for row_index, row_text in enumerate(body):
+        for col_index, formatted_value in enumerate(row_text):
+            app.set_cell_text(table.cell(row_index + 1, col_index), formatted_value, "body")
+
+
+def bench_tables(args):
+    # Full generation with a 1k/10k-row ZipCodes tab (paginated onto
+    # continuation slides), checked to open with every page registered; then
+    # one table grown to all rows, bulk fill vs per-cell table.cell lookups
+    plan = app.get_render_plan(args.template)
+    tmpdir = tempfile.mkdtemp()
+    status = 0
+    try:
+        for rows in args.rows:
+            path = os.path.join(tmpdir, f"zipcodes_{rows}.xlsm")
+            make_zipcode_worksheet(args.worksheet, rows, path)
+            runs = [app.run_generation(path, args.template) for _ in range(args.repeat)]
+            render_times = [sum(stats["stages"][stage]["seconds"] for stage in ("tables", "slides", "save"))
+                            for _, stats in runs]
+            print(f"{rows} zip-code rows")
+            _report("  tables+slides+save", render_times)
+            print(f"{'':<28} {min(render_times) / rows * 1e6:8.1f} us/row")
+
+            dfs, cells = app.load_worksheet(path, plan["ranges"], plan["table_sheets"])
+            _, work = app.prepare_slides(plan, dfs, cells, app.StageTimer())
+            expected = len(plan["slide_parts"]) + sum(len(slide_work["pages"]) for slide_work in work.values())
+            slides = len(Presentation(runs[-1][0]).slides)
+            if slides != expected:
+                print(f"{'':<28} MISMATCH: {slides} slides, expected {expected}")
+                status = 1
+
+            body = _zipcode_table(plan, dfs, rows)[1]
+            fresh_frame = lambda: _zipcode_table(plan, dfs, rows)[0]
+            bulk = _timeit(lambda frame: app.fill_table(
+                frame, {"header": [], "body": body, "first_row_header": False}), args.repeat, fresh_frame)
+            _report("  one table: bulk fill", bulk)
+            if rows <= args.legacy_max:
+                legacy = _timeit(lambda frame: _legacy_table_fill(frame.table, body), args.repeat, fresh_frame)
+                _report("  one table: table.cell", legacy)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return status
+
+
+# ---------------- Up-front validation ----------------
+def _break_worksheet(worksheet, plan, path):
+    # A blank and a text value in two placeholder cells on a non-table tab.
+    # openpyxl drops cached formula results on save, so formula-backed
+    # placeholders come out blank as well
+    cells = [(sheet, row, col) for _, sheet, row, col, fmt in app.spec_cells(plan["placeholders"], plan["grids"])
+             if fmt != "raw" and sheet not in plan["table_sheets"]][:2]
+    workbook = openpyxl.load_workbook(worksheet, keep_vba=True)
+    for (sheet, row, col), value in zip(cells, [None, "n/a"]):
+        # cell(value=None) leaves the value alone, so assign it
+        workbook[sheet].cell(row=row, column=col).value = value
+    workbook.save(path)
+
+
+def bench_validate(args):
+    # How soon a bad upload is turned away: validate_worksheet alone vs the
+    # full parse it saves, on the real worksheet and a broken copy
+    plan = app.get_render_plan(args.template)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        broken = os.path.join(tmpdir, "broken.xlsm")
+        _break_worksheet(args.worksheet, plan, broken)
+        for label, path in (("worksheet", args.worksheet), ("broken copy", broken)):
+            problems = app.validate_worksheet(path, plan)
+            print(f"{label}: {len(problems)} problem(s)")
+            for problem in problems:
+                print(f"  {problem['code']}: {problem['message']}")
+            _report("  validate_worksheet", _timeit(lambda _: app.validate_worksheet(path, plan), args.repeat))
+            _report("  load_worksheet", _timeit(lambda _: app.load_worksheet(path), args.repeat))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+# --------------- CLI ---------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE)
+    parser.add_argument("--worksheet", default=DEFAULT_WORKSHEET)
+    parser.add_argument("--repeat", type=int, default=5)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("substitution", help="compiled regex vs nested str.replace loop").set_defaults(func=bench_substitution)
+    sub.add_parser("loader", help="load_worksheet vs pd.read_excel: parse time and peak RSS").set_defaults(func=bench_loader)
+    batch = sub.add_parser("batch", help="run_batch throughput (decks/minute) vs worker count")
+    batch.add_argument("--decks", type=int, default=12)
+    batch.add_argument("--workers", type=int, nargs="*", help="worker counts to try (default 1 2 4 ncpu)")
+    batch.set_defaults(func=bench_batch)
+    sub.add_parser("styling", help="cloned rPr fragments vs per-run font properties").set_defaults(func=bench_styling)
+    regression = sub.add_parser("regression", help="registry vs equals-scan output (must match); sheet lookup CPU time")
+    regression.add_argument("--baseline", help="also compare with a .pptx generated by a previous commit from the same inputs")
+    regression.set_defaults(func=bench_regression)
+    suite = sub.add_parser("suite", help="end-to-end and per-stage timings on 1x/10x/100x synthetic worksheets")
+    suite.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    suite.add_argument("--output", default="bench_results.json")
+    suite.add_argument("--compare", help="results JSON from an earlier commit; exit 1 on regression")
+    suite.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown as a fraction (default 0.25)")
+    suite.set_defaults(func=bench_suite)
+    measure_generation = sub.add_parser("_measure-generation")
+    measure_generation.set_defaults(func=lambda a: print(json.dumps(_measure_generation(a.worksheet, a.template, a.repeat))))
+    package = sub.add_parser("package", help="template-zip patching vs prs.save: save time and slide equality")
+    package.add_argument("--images", type=int, default=20, help="also test a copy with this many large images")
+    package.set_defaults(func=bench_package)
+    render = sub.add_parser("render", help="report render time vs RENDER_WORKERS; output checked against sequential")
+    render.add_argument("--workers", type=int, nargs="*", help="worker counts to try (default 1 2 4 ncpu)")
+    render.set_defaults(func=bench_render)
+    tables = sub.add_parser("tables", help="1k/10k-row slide tables: pagination cost per row, bulk vs per-cell fill")
+    tables.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    tables.add_argument("--legacy-max", type=int, default=2000, help="skip the per-cell fill above this many rows")
+    tables.set_defaults(func=bench_tables)
+    sub.add_parser("validate", help="validate_worksheet vs load_worksheet on the worksheet and a broken copy").set_defaults(
+        func=bench_validate)
+    coldstart = sub.add_parser("coldstart", help="worker cold start and RSS: lazy vs per-worker warm-up vs --preload")
+    coldstart.add_argument("--workers", type=int, default=2)
+    coldstart.set_defaults(func=bench_coldstart)
+    check_render_workers = sub.add_parser("_check-render-workers")
+    check_render_workers.set_defaults(func=lambda a: print(json.dumps(_check_render_workers(a.worksheet, a.template))))
+    measure_coldstart = sub.add_parser("_measure-coldstart")
+    measure_coldstart.add_argument("mode", choices=list(COLDSTART_MODES))
+    measure_coldstart.add_argument("--workers", type=int, default=2)
+    measure_coldstart.set_defaults(
+        func=lambda a: print(json.dumps(_measure_coldstart(a.mode, a.worksheet, a.template, a.workers))))
+    measure = sub.add_parser("_measure-loader")
+    measure.add_argument("label", choices=list(LOADERS))
+    measure.set_defaults(func=lambda a: print(json.dumps(_measure_loader(a.label, a.worksheet))))
+
+    args = parser.parse_args(argv)
+    if args.func in (bench_substitution, bench_batch, bench_regression, bench_styling, bench_suite,
+                     bench_coldstart, bench_package, bench_render, bench_tables, bench_validate) and not os.path.exists(args.template):
+        parser.error(f"template not found: {args.template}")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())